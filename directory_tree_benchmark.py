@@ -0,0 +1,246 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Times the walk and the renderers of directory_tree_generator.v5.py on synthetic trees, so
+# runs on different commits can be compared. It also times how long a run takes to print the
+# first line of a small tree, for the script and for any built launchers. Usage:
+#   python directory_tree_benchmark.py --sizes 10000 100000 --output before.json
+
+SHAPES = ['wide-flat', 'deep-narrow', 'monorepo']
+STARTUP_ENTRIES = 200  # Small tree for time-to-first-line, so startup dominates
+STARTUP_TARGET_S = 0.1
+DEEP_NARROW_DEPTH = 500  # Deeper chains run into the platform's path length limit
+FILE_NAMES = ['index.js', '__init__.py', 'README.md', 'utils.py', 'main.go', 'config.json', 'test_main.py',
+              'styles.css', 'app.tsx', 'Makefile', 'setup.cfg', 'data.csv', 'logo.png', 'notes.txt']
+DIR_NAMES = ['src', 'lib', 'tests', 'docs', 'core', 'api', 'utils', 'components', 'models', 'scripts']
+
+def load_generator(script_path):
+    # The script name has a dot in it, so it cannot be imported by name
+    spec = importlib.util.spec_from_file_location('directory_tree_generator', script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def touch(path):
+    open(path, 'w').close()
+
+def make_wide_flat(root, entries, rng):
+    for index in range(entries):
+        touch(os.path.join(root, f"file_{index:07d}{rng.choice(['.txt', '.py', '.js', '.json'])}"))
+    return entries
+
+def make_deep_narrow(root, entries, rng):
+    # Chains of single folders, each level holding a few files
+    files_per_level = 4
+    created = 0
+    chain = 0
+    while created < entries:
+        path = os.path.join(root, f"chain_{chain}")
+        for level in range(DEEP_NARROW_DEPTH):
+            if created >= entries:
+                break
+            os.mkdir(path)
+            created += 1
+            for index in range(min(files_per_level, entries - created)):
+                touch(os.path.join(path, f"f{index}{rng.choice(['.c', '.h'])}"))
+                created += 1
+            path = os.path.join(path, 'd')
+        chain += 1
+    return created
+
+def make_monorepo(root, entries, rng):
+    # Packages with nested source folders of uneven size and the usual repeated file names
+    created = 0
+    package = 0
+    while created < entries:
+        package_path = os.path.join(root, 'packages', f"package_{package:04d}")
+        os.makedirs(package_path)
+        created += 1
+        stack = [(package_path, 0)]
+        budget = rng.randint(50, 4000)
+        while stack and budget > 0 and created < entries:
+            path, depth = stack.pop()
+            for index in range(rng.randint(2, 30)):
+                touch(os.path.join(path, f"{index}_{rng.choice(FILE_NAMES)}"))
+                created += 1
+                budget -= 1
+            if depth < rng.randint(2, 6):
+                for name in rng.sample(DIR_NAMES, rng.randint(1, 4)):
+                    child = os.path.join(path, name)
+                    os.mkdir(child)
+                    created += 1
+                    budget -= 1
+                    stack.append((child, depth + 1))
+        package += 1
+    return created
+
+SHAPE_BUILDERS = {
+    'wide-flat': make_wide_flat,
+    'deep-narrow': make_deep_narrow,
+    'monorepo': make_monorepo,
+}
+
+def build_tree(base_dir, shape, entries, seed):
+    # Trees are reproducible from (shape, entries, seed) and reused if the folder already exists
+    root = os.path.join(base_dir, f"{shape}_{entries}_{seed}")
+    marker = os.path.join(root, '.complete')
+    if os.path.exists(marker):
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    SHAPE_BUILDERS[shape](root, entries, random.Random(seed))
+    touch(marker)
+    return root
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def launcher_command(launcher):
+    # Scripts and zipapps run on this interpreter, anything else (a built exe) runs as is
+    if launcher.endswith(('.py', '.pyz')):
+        return [sys.executable, launcher]
+    return [launcher]
+
+def time_to_first_line(command, root, runs):
+    # Wall time from starting the process until the first line of the TXT tree arrives on the pipe
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(command + [root, '--stdout', '--format', 'txt'], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        first_line = process.stdout.readline()
+        elapsed = time.perf_counter() - start
+        process.stdout.read()
+        if process.wait() != 0 or not first_line:
+            raise RuntimeError(f"{' '.join(command)} failed with exit code {process.returncode}")
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_case(generator, root, repeat, workers):
+    def new_scanner():
+        return generator.DirectoryScanner(workers=workers, exclude_patterns=['.complete'])
+
+    def walk():
+        with new_scanner() as scanner:
+            generator.scan_tree(root, scanner=scanner)
+
+    # Renderers are timed on a tree that is already loaded, so they do not include listing
+    scanner = new_scanner()
+    tree = generator.scan_tree(root, scanner=scanner)
+    scanner.close()
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_path = os.path.join(out_dir, 'out')
+
+        def render_txt():
+            with open(out_path, 'w', encoding='utf-8', buffering=1024 * 1024) as out_file:
+                generator.write_tree_lines(generator.iter_tree_lines(root, tree=tree, keep_tree=True, scanner=scanner),
+                                           out_file)
+
+        def render_html():
+            with open(out_path, 'w', encoding='utf-8', buffering=1024 * 1024) as out_file:
+                generator.write_html_tree(root, out_file, tree=tree, scanner=scanner)
+
+        def render_viewer():
+            with open(out_path, 'w', encoding='utf-8', buffering=1024 * 1024) as out_file:
+                generator.write_html_viewer(root, out_file, tree=tree, scanner=scanner)
+
+        result = {
+            'walk_s': timed(walk, repeat),
+            'txt_s': timed(render_txt, repeat),
+            'html_s': timed(render_html, repeat),
+            'viewer_s': timed(render_viewer, repeat),
+        }
+    del tree
+
+    # Peak memory is measured on a separate walk: tracemalloc slows allocation down too much
+    # to be left on while timing
+    tracemalloc.start()
+    with new_scanner() as scanner:
+        tree = generator.scan_tree(root, scanner=scanner)
+    result['walk_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    del tree
+    return result
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark the directory tree walk and renderers on synthetic trees.")
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES,
+                        help="tree shapes to generate (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000], metavar='N',
+                        help="number of entries per tree, e.g. 10000 100000 1000000 (default: 10000 100000)")
+    parser.add_argument('--seed', type=int, default=1, help="seed for the tree generator (default: 1)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the fastest is kept (default: 3)")
+    parser.add_argument('--workers', type=int, default=1, help="listing threads for the walk (default: 1)")
+    parser.add_argument('--tree-dir', metavar='DIR',
+                        help="keep the generated trees here and reuse them on later runs (default: a temp dir)")
+    parser.add_argument('--generator', default=os.path.join(script_dir, 'directory_tree_generator.v5.py'),
+                        metavar='SCRIPT', help="generator script to benchmark (default: directory_tree_generator.v5.py)")
+    parser.add_argument('--output', default='benchmark_results.json', metavar='FILE',
+                        help="where to write the JSON results (default: benchmark_results.json)")
+    parser.add_argument('--launcher', action='append', default=[], metavar='PATH',
+                        help="also time the startup of this build, e.g. dist/directory_tree_generator.v5.pyz or the "
+                             "onedir exe (repeatable)")
+    parser.add_argument('--startup-runs', type=int, default=10,
+                        help="runs per time-to-first-line measurement, the fastest is kept (default: 10)")
+    args = parser.parse_args()
+
+    generator = load_generator(args.generator)
+    base_dir = args.tree_dir or tempfile.mkdtemp(prefix='tree_benchmark_')
+    os.makedirs(base_dir, exist_ok=True)
+
+    results = []
+    startup = []
+    try:
+        root = build_tree(base_dir, 'monorepo', STARTUP_ENTRIES, args.seed)
+        for launcher in [args.generator] + args.launcher:
+            first_line_s = time_to_first_line(launcher_command(launcher), root, args.startup_runs)
+            startup.append({'launcher': os.path.basename(launcher), 'first_line_s': first_line_s,
+                            'under_target': first_line_s < STARTUP_TARGET_S})
+            print(f"startup {os.path.basename(launcher)}: first line after {first_line_s * 1000:.0f} ms "
+                  f"(target {STARTUP_TARGET_S * 1000:.0f} ms)", flush=True)
+        for shape in args.shapes:
+            for entries in args.sizes:
+                build_start = time.perf_counter()
+                root = build_tree(base_dir, shape, entries, args.seed)
+                print(f"{shape} {entries}: tree ready in {time.perf_counter() - build_start:.1f}s", flush=True)
+                result = {'shape': shape, 'entries': entries}
+                result.update(run_case(generator, root, args.repeat, args.workers))
+                results.append(result)
+                print(f"    walk {result['walk_s']:.3f}s  txt {result['txt_s']:.3f}s  html {result['html_s']:.3f}s  "
+                      f"viewer {result['viewer_s']:.3f}s  peak {result['walk_peak_mb']:.1f} MB", flush=True)
+    finally:
+        if args.tree_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    report = {
+        'generator': os.path.basename(args.generator),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'workers': args.workers,
+        'startup_target_s': STARTUP_TARGET_S,
+        'startup': startup,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as out_file:
+        json.dump(report, out_file, indent=2)
+    print(f"Wrote {args.output}")
@@ -0,0 +1,47 @@
+# -*- mode: python ; coding: utf-8 -*-
+
+# Startup-optimized build: a folder instead of a single exe, so nothing is unpacked to a temp
+# dir on each run, and no UPX, so the DLLs are not decompressed on load either.
+# asyncio is only used by aiter_tree_entries when the script is imported as a library.
+
+a = Analysis(
+    ['directory_tree_generator.v5.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['asyncio', 'tkinter', 'unittest', 'pydoc', 'doctest', 'pdb', 'lib2to3', 'xmlrpc'],
+    noarchive=False,
+    optimize=0,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='directory_tree_generator.v5',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='directory_tree_generator.v5_onedir',
+)
@@ -1,79 +1,1484 @@
+import argparse
+import bisect
+import contextlib
+import heapq
+import fnmatch
+import functools
+import io
+import json
 import os
+import re
+import select
+import struct
 import sys
-import webbrowser
+import threading
+import time
+from array import array
 
-def generate_tree(dir_path, prefix='', exclude_files=None, is_root=True, result_lines=None):
-    if result_lines is None:
-        result_lines = []
+# Modules only some runs need (concurrent.futures, asyncio, ctypes, multiprocessing, webbrowser,
+# hashing and compression) are imported where they are used, so a plain TXT run starts faster
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+class TreeNode:
+    __slots__ = ('name', 'is_dir', 'children')
+
+    def __init__(self, name, is_dir, children=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.children = children
+
+class MetaNode(TreeNode):
+    # Used in metadata mode only, so plain walks do not pay for the extra fields. For a
+    # folder, size, files and mtime are the totals of its subtree once compute_totals ran
+    __slots__ = ('size', 'mtime', 'files', 'inode', 'digest')
+
+    def __init__(self, name, is_dir, size=0, mtime=0.0, inode=0, children=None):
+        super().__init__(name, is_dir, children)
+        self.size = size
+        self.mtime = mtime
+        self.files = 0
+        self.inode = inode
+        self.digest = None
+
+class LinkNode(TreeNode):
+    # A symbolic link; target is what the link points to, shown next to the name
+    __slots__ = ('target',)
+
+    def __init__(self, name, is_dir, children=None):
+        super().__init__(name, is_dir, children)
+        self.target = ''
+
+class SizedNode(TreeNode):
+    # A file with its size from the listing, for jsonl, json and csv outputs without
+    # --metadata; folder totals need the whole subtree, so folders stay plain nodes
+    __slots__ = ('size',)
+
+    def __init__(self, name, size):
+        super().__init__(name, False)
+        self.size = size
+
+class SizedLinkNode(LinkNode):
+    __slots__ = ('size',)
+
+    def __init__(self, name, size):
+        super().__init__(name, False)
+        self.size = size
+
+class MetaLinkNode(MetaNode):
+    __slots__ = ('target',)
+
+    def __init__(self, name, is_dir, size=0, mtime=0.0, inode=0, children=None):
+        super().__init__(name, is_dir, size, mtime, inode, children)
+        self.target = ''
+
+class AliasNode(TreeNode):
+    # With --symlinks follow, a folder whose physical directory is listed at another path;
+    # it is shown with that path instead of its entries. target is set when it is a link
+    __slots__ = ('target', 'listed_at')
+
+    def __init__(self, node, listed_at):
+        super().__init__(node.name, True, [])
+        self.target = getattr(node, 'target', None)
+        self.listed_at = listed_at
+
+class MetaAliasNode(MetaNode):
+    __slots__ = ('target', 'listed_at')
+
+    def __init__(self, node, listed_at):
+        super().__init__(node.name, True, node.size, node.mtime, node.inode, [])
+        self.target = getattr(node, 'target', None)
+        self.listed_at = listed_at
+
+def display_name(node):
+    target = getattr(node, 'target', None)
+    name = node.name if target is None else f"{node.name} -> {target}"
+    listed_at = getattr(node, 'listed_at', None)
+    return name if listed_at is None else f"{name} (listed at {listed_at})"
+
+class MoreEntriesNode(TreeNode):
+    # Stands in for the entries a size limit left out of a directory listing
+    __slots__ = ('count',)
+
+    def __init__(self, count):
+        super().__init__(f"… {count} more {'entry' if count == 1 else 'entries'}", False)
+        self.count = count
+
+class ErrorNode(MoreEntriesNode):
+    # Stands in for the entries of a directory that could not be listed (no permission, gone,
+    # too many link levels); the rest of the tree is still written
+    __slots__ = ('reason',)
+
+    def __init__(self, error):
+        self.reason = error.strerror or str(error)
+        TreeNode.__init__(self, f"⚠ not listed: {self.reason}", False)
+        self.count = 0
+
+class TreeSnapshot:
+    # Directory listings from the previous run keyed by path relative to the root. A cached
+    # listing is reused while the directory mtime is unchanged and old enough that a change
+    # within the same timestamp tick could not have been missed. Each entry has one flag
+    # digit: 1 if it is (or links to) a directory, plus 2 if it is a symlink
+    MTIME_SLACK_NS = 2_000_000_000
+
+    def __init__(self, root, listings=None, created_ns=0):
+        self.root = root
+        self.listings = listings if listings is not None else {}
+        self.created_ns = created_ns
+        self.start_ns = time.time_ns()
+        self.updated = {}
+        self.reused = 0
+
+    @classmethod
+    def load(cls, snapshot_path, root):
+        try:
+            with open(snapshot_path, 'r', encoding='utf-8') as snapshot_file:
+                data = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return cls(root)
+        if data.get('root') != root:
+            return cls(root)
+        return cls(root, data.get('listings', {}), data.get('created_ns', 0))
+
+    def save(self, snapshot_path):
+        data = {'root': self.root, 'created_ns': self.start_ns, 'listings': self.updated}
+        temp_path = snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump(data, snapshot_file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, snapshot_path)
+
+    def key(self, dir_path):
+        return dir_path[len(self.root) + 1:] if dir_path != self.root else ''
+
+    def list_dir(self, dir_path):
+        key = self.key(dir_path)
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        cached = self.listings.get(key)
+        if cached is not None and cached[0] == mtime_ns and mtime_ns < self.created_ns - self.MTIME_SLACK_NS:
+            self.updated[key] = cached
+            self.reused += 1
+            return self.decode(cached)
+
+        with os.scandir(dir_path) as entries:
+            listing = [(entry.name, entry.is_dir(), entry.is_symlink()) for entry in entries]
+        self.updated[key] = [mtime_ns, [name for name, _, _ in listing],
+                             ''.join(str(is_dir + 2 * is_link) for _, is_dir, is_link in listing)]
+        return listing
+
+    @staticmethod
+    def decode(cached):
+        return [(name, flag in '13', flag in '23') for name, flag in zip(cached[1], cached[2])]
+
+DEFAULT_EXCLUDE_PATTERNS = ['*.pyc']
+
+class SnapshotReader(TreeSnapshot):
+    # Serves listings straight from a saved snapshot without touching the filesystem, so an
+    # earlier run can be walked like a directory
+    @classmethod
+    def open(cls, snapshot_path):
+        with open(snapshot_path, 'r', encoding='utf-8') as snapshot_file:
+            data = json.load(snapshot_file)
+        return cls(data['root'], data.get('listings', {}), data.get('created_ns', 0))
+
+    def list_dir(self, dir_path):
+        cached = self.listings.get(self.key(dir_path))
+        if cached is None:
+            return []  # Not recorded, e.g. excluded or beyond a limit in that run
+        return self.decode(cached)
+
+def parse_exclude_patterns(lines):
+    # .gitignore syntax: "name" matches at any depth, a pattern containing "/" is anchored
+    # to the directory it was given for, a trailing "/" only matches directories and "**"
+    # matches zero or more directories. Negated ("!") patterns are not supported and are skipped
+    unanchored = []
+    anchored = []
+    for line in lines:
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#') or line.startswith('!'):
+            continue
+        if line.startswith('\\'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        has_slash = '/' in line  # "a/**" stays anchored to the directory once "/**" is cut off
+        while line.endswith('/**'):
+            line, dir_only = line[:-3], True
+        any_depth = False
+        while line.startswith('**/'):
+            line, any_depth = line[3:], True
+        if not line:
+            continue
+        if '/' in line or (has_slash and not any_depth):
+            parts = (['**'] if any_depth else []) + [part for part in line.lstrip('/').split('/') if part]
+            # A run of "**" matches the same as one
+            components = tuple(part for index, part in enumerate(parts)
+                               if part != '**' or index == 0 or parts[index - 1] != '**')
+            anchored.append((components, dir_only))
+        else:
+            unanchored.append((line, dir_only))
+    return unanchored, anchored
+
+class ExclusionRules:
+    # Exact names become set lookups and every glob of a kind is folded into one regex, so
+    # checking an entry costs a constant number of operations however many patterns exist.
+    # Anchored patterns only apply at their own level and are narrowed one component per
+    # directory; rules that do not change between levels are shared
+    def __init__(self, unanchored=(), anchored=(), names=()):
+        self.unanchored = list(unanchored)
+        self.anchored = list(anchored)
+        self.extra_names = frozenset(names)
+        anchored = list(self.expand(self.anchored))
+        self.pending = [(components, dir_only) for components, dir_only in anchored if len(components) > 1]
+        level = [(components[0], dir_only) for components, dir_only in anchored if len(components) == 1]
+        self.names, self.regex = self.compile([pattern for pattern, dir_only in self.unanchored + level if not dir_only])
+        self.names |= self.extra_names
+        self.dir_names, self.dir_regex = self.compile([pattern for pattern, dir_only in self.unanchored + level if dir_only])
+        self.base = self if not self.anchored else None
+
+    @classmethod
+    def from_patterns(cls, patterns, names=()):
+        unanchored, anchored = parse_exclude_patterns(patterns)
+        return cls(unanchored, anchored, names)
+
+    @staticmethod
+    def expand(anchored):
+        # A leading "**" may match no directory at all, so the rest of the pattern also applies
+        # at this level. The parser never leaves "**" last or twice in a row
+        for components, dir_only in anchored:
+            yield components, dir_only
+            if components[0] == '**':
+                yield components[1:], dir_only
+
+    @staticmethod
+    def compile(patterns):
+        names = set()
+        globs = []
+        for pattern in patterns:
+            if any(char in pattern for char in '*?['):
+                globs.append(fnmatch.translate(pattern))
+            else:
+                names.add(pattern)
+        return names, re.compile('|'.join(globs)) if globs else None
+
+    def excludes(self, name, is_dir):
+        if name in self.names or (self.regex is not None and self.regex.match(name)):
+            return True
+        if is_dir:
+            return name in self.dir_names or (self.dir_regex is not None and self.dir_regex.match(name) is not None)
+        return False
+
+    def child_rules(self, name):
+        # "**" consumes the directory and stays in front, so it keeps matching further down
+        anchored = [(components if components[0] == '**' else components[1:], dir_only)
+                    for components, dir_only in self.pending if fnmatch.fnmatchcase(name, components[0])]
+        if anchored:
+            return ExclusionRules(self.unanchored, anchored, self.extra_names)
+        if self.base is None:
+            self.base = ExclusionRules(self.unanchored, (), self.extra_names)
+        return self.base
+
+    def with_gitignore(self, gitignore_path):
+        try:
+            with open(gitignore_path, 'r', encoding='utf-8', errors='replace') as gitignore_file:
+                unanchored, anchored = parse_exclude_patterns(gitignore_file)
+        except OSError:
+            return self
+        if not unanchored and not anchored:
+            return self
+        return ExclusionRules(self.unanchored + unanchored, self.anchored + anchored, self.extra_names)
+
+def entry_stat(entry, is_dir):
+    # lstat, so a symlink counts as the link and not its target; folder sizes are rolled up later
+    try:
+        stat = entry.stat(follow_symlinks=False)
+    except OSError:
+        return 0, 0.0, 0
+    return (0 if is_dir else stat.st_size), stat.st_mtime, stat.st_ino
+
+SORT_ORDERS = ['name', 'natural', 'none']
+DIGIT_RUNS = re.compile(r'(\d+)')
+
+def natural_key(name):
+    # 'file2' before 'file10': digit runs compare as numbers. re.split alternates text and
+    # digits, so two keys always hold the same type at the same position
+    parts = DIGIT_RUNS.split(name.casefold())
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
+def make_sort_key(order='name', dirs_first=False):
+    # Picked once per scanner, so each listing sort computes one key per entry and no
+    # per-comparison work; None means keep the order the filesystem returned
+    if order == 'natural':
+        key = lambda entry: natural_key(entry[0])
+    elif order == 'name':
+        key = lambda entry: entry[0].casefold()
+    else:
+        key = None
+    if not dirs_first:
+        return key
+    if key is None:
+        return lambda entry: not entry[1]
+    return lambda entry: (not entry[1], key(entry))
+
+def compute_totals(tree):
+    # Single post-order pass over the loaded tree: every folder gets the bytes, file count
+    # and newest mtime of its subtree
+    stack = [(tree, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = node.children if isinstance(node.children, list) else []
+        if not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children if child.is_dir)
+            continue
+
+        size = files = 0
+        mtime = node.mtime
+        for child in children:
+            if isinstance(child, MoreEntriesNode):
+                continue
+            size += child.size
+            files += child.files if child.is_dir else 1
+            if child.mtime > mtime:
+                mtime = child.mtime
+        node.size, node.files, node.mtime = size, files, mtime
+
+def sort_by_size(tree, top=None):
+    # Largest first in every folder; with top, only the N largest entries are kept
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node.children, list):
+            continue
+        children = [child for child in node.children if not isinstance(child, MoreEntriesNode)]
+        omitted = sum(child.count for child in node.children if isinstance(child, MoreEntriesNode))
+        children.sort(key=lambda child: child.size, reverse=True)
+        if top is not None and len(children) > top:
+            omitted += len(children) - top
+            del children[top:]
+        children.extend(child for child in node.children if isinstance(child, ErrorNode))
+        if omitted:
+            children.append(MoreEntriesNode(omitted))
+        node.children = children
+        stack.extend(child for child in children if child.is_dir)
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f"{size} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def describe_entry(node):
+    modified = time.strftime('%Y-%m-%d %H:%M', time.localtime(node.mtime))
+    if node.is_dir:
+        return f"{format_size(node.size)}, {node.files} {'file' if node.files == 1 else 'files'}, {modified}"
+    if node.digest is not None:
+        return f"{format_size(node.size)}, {modified}, blake2b:{node.digest}"
+    return f"{format_size(node.size)}, {modified}"
+
+HASH_MMAP_THRESHOLD = 4 * 1024 * 1024  # Larger files are hashed through mmap
+HASH_BATCH_FILES = 256  # Small files are sent to the pool in batches to cut IPC overhead
+HASH_BATCH_BYTES = 16 * 1024 * 1024
+HASH_INLINE_BYTES = 32 * 1024 * 1024  # Below this much work, starting a process pool costs more than it saves
+
+def hash_file(path, size):
+    import hashlib
+    import mmap
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as hashed_file:
+        if size >= HASH_MMAP_THRESHOLD:
+            with mmap.mmap(hashed_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            digest.update(hashed_file.read())
+    return digest.hexdigest()
+
+def hash_batch(batch):
+    # Runs in a worker process
+    digests = []
+    for path, size in batch:
+        try:
+            digests.append(hash_file(path, size))
+        except (OSError, ValueError):
+            digests.append(None)
+    return digests
+
+def hash_tree(tree, dir_path, workers=None, cache=None, pool=None):
+    # Fingerprints every file of a loaded metadata tree. Digests are cached by
+    # (inode, size, mtime), so unchanged files are not read again; returns the cache entries
+    # for the files seen in this tree. A pool passed in is shared between calls and left running
+    if cache is None:
+        cache = {}
+    seen = {}
+    pending = []
+    stack = [(tree, dir_path)]
+    while stack:
+        node, path = stack.pop()
+        for child in node.children if isinstance(node.children, list) else ():
+            if isinstance(child, MoreEntriesNode):
+                continue
+            child_path = os.path.join(path, child.name)
+            if child.is_dir:
+                stack.append((child, child_path))
+                continue
+            key = f"{child.inode}:{child.size}:{child.mtime!r}"
+            child.digest = cache.get(key)
+            if child.digest is None:
+                pending.append((child, child_path, key))
+            else:
+                seen[key] = child.digest
+
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for node, path, key in pending:
+        if node.size >= HASH_MMAP_THRESHOLD:
+            batches.append([(node, path, key)])
+            continue
+        batch.append((node, path, key))
+        batch_bytes += node.size
+        if len(batch) >= HASH_BATCH_FILES or batch_bytes >= HASH_BATCH_BYTES:
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+    if batch:
+        batches.append(batch)
+
+    work = [[(path, node.size) for node, path, _ in batch] for batch in batches]
+    owned_pool = None
+    if workers == 1 or sum(node.size for node, _, _ in pending) < HASH_INLINE_BYTES:
+        results = map(hash_batch, work)
+    else:
+        if pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = owned_pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(hash_batch, work)
+    try:
+        for batch, digests in zip(batches, results):
+            for (node, _, key), digest in zip(batch, digests):
+                node.digest = digest
+                if digest is not None:
+                    seen[key] = digest
+    finally:
+        if owned_pool is not None:
+            owned_pool.shutdown()
+    return seen
+
+def load_hash_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_hash_cache(cache_path, cache):
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as cache_file:
+        json.dump(cache, cache_file, separators=(',', ':'))
+    os.replace(temp_path, cache_path)
+
+def peak_rss_bytes():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports KiB
+    if sys.platform == 'win32':
+        import ctypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + [
+                (name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                                                     'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                                                     'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                 counters.cb)
+        return counters.PeakWorkingSetSize
+    return None
+
+class ProfiledWriter:
+    # Passes writes through to out_file, timing them and counting characters
+    def __init__(self, out_file, profile):
+        self.out_file = out_file
+        self.profile = profile
+
+    def write(self, text):
+        start = time.perf_counter()
+        self.out_file.write(text)
+        self.profile.write_time += time.perf_counter() - start
+        self.profile.chars_written += len(text)
+        self.profile.write_calls += 1
+
+class RunProfile:
+    # Counters and timers for --profile. Phases are wall-clock sections of a run. Listing and
+    # sorting happen inside them (lazily, or on the prefetch threads) and are summed per
+    # directory by the scanner, writing is summed by ProfiledWriter; rendering is the rest
+    def __init__(self, top=10):
+        self.top = top
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.phase_listing = {}  # Listing time spent inside each phase on the calling thread
+        self.scanner = None  # Set by the DirectoryScanner the profile is given to
+        self.slowest = []  # Min-heap of (seconds, path) holding the slowest listings
+        self.write_time = 0.0
+        self.chars_written = 0
+        self.write_calls = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        listed = self.scanner.list_time if self.scanner is not None else 0.0
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            if self.scanner is not None:
+                self.phase_listing[name] = self.phase_listing.get(name, 0.0) + self.scanner.list_time - listed
+
+    def record_dir(self, dir_path, seconds):
+        # Called with the scanner lock held
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, (seconds, dir_path))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, dir_path))
+
+    def report(self, scanner):
+        total = time.perf_counter() - self.start
+        snapshot = scanner.snapshot
+        scandir_calls = scanner.dirs_listed
+        stat_calls = scanner.stat_calls
+        if isinstance(snapshot, SnapshotReader):
+            scandir_calls = 0
+        elif snapshot is not None:
+            scandir_calls -= snapshot.reused
+            stat_calls += scanner.dirs_listed  # The mtime check before each listing
+        render_time = sum(seconds for name, seconds in self.phases.items() if name.startswith('render'))
+        if scanner.workers <= 1:
+            # Serial walks list lazily while rendering; with a pool the renderer only waits
+            render_time -= sum(seconds for name, seconds in self.phase_listing.items() if name.startswith('render'))
+        return {
+            'total_s': total,
+            'phases_s': self.phases,
+            'listing_s': scanner.list_time,
+            'sorting_s': scanner.sort_time,
+            'writing_s': self.write_time,
+            'rendering_s': max(render_time - self.write_time, 0.0),
+            'dirs': scanner.dirs_listed,
+            'entries': scanner.entries_listed,
+            'dirs_per_s': scanner.dirs_listed / total if total else 0.0,
+            'entries_per_s': scanner.entries_listed / total if total else 0.0,
+            'syscalls': {'scandir': scandir_calls, 'stat': stat_calls, 'readlink': scanner.readlink_calls,
+                         'total': scandir_calls + stat_calls + scanner.readlink_calls},
+            'chars_written': self.chars_written,
+            'write_calls': self.write_calls,
+            'slowest_dirs': [{'path': path, 'ms': seconds * 1000} for seconds, path in sorted(self.slowest, reverse=True)],
+            'peak_rss_bytes': peak_rss_bytes(),
+            'workers': scanner.workers,
+        }
+
+    @staticmethod
+    def summary(report):
+        rss = report['peak_rss_bytes']
+        return (f"Profile: {report['dirs']} dirs, {report['entries']} entries in {report['total_s']:.2f}s "
+                f"({report['dirs_per_s']:.0f} dirs/s, {report['entries_per_s']:.0f} entries/s); "
+                f"listing {report['listing_s']:.2f}s, sorting {report['sorting_s']:.2f}s, "
+                f"rendering {report['rendering_s']:.2f}s, writing {report['writing_s']:.2f}s; "
+                f"{report['syscalls']['total']} syscalls"
+                + (f"; peak RSS {format_size(rss)}" if rss is not None else ''))
+
+class DirectoryScanner:
+    def __init__(self, exclude_files=None, workers=1, snapshot=None, exclude_patterns=None, use_gitignore=False,
+                 max_depth=None, max_entries_per_dir=None, max_total_entries=None, metadata=False,
+                 rules=None, executor=None, symlinks='show', profile=None, sort='name', dirs_first=False,
+                 file_sizes=False):
+        self.exclude_files = exclude_files if exclude_files is not None else []
+        if rules is None:
+            rules = self.build_rules(self.exclude_files, exclude_patterns, use_gitignore)
+        self.rules = rules
+        self.dir_rules = {}  # Directory path -> rules, only where they differ from the parent's
+        self.use_gitignore = use_gitignore
+        self.max_depth = max_depth
+        self.depths = {}  # Directory path -> depth below the root, only tracked with max_depth
+        self.max_entries_per_dir = max_entries_per_dir
+        self.max_total_entries = max_total_entries
+        self.remaining = max_total_entries  # Entries left before the walk stops listing
+        self.metadata = metadata
+        self.file_sizes = file_sizes and not metadata  # Metadata mode has the sizes already
+        # 'skip' leaves symlinks out, 'show' lists them without following them and 'follow'
+        # walks linked directories, listing each physical directory (device, inode) only once
+        self.symlinks = symlinks
+        self.visited = {} if symlinks == 'follow' else None  # (st_dev, st_ino) -> first path listed
+        self.dir_keys = {}  # Folder path -> (st_dev, st_ino), from the listing until the renderer claims it
+        self.root = self.root_real = None
+        # Children are stored in this order, so every renderer walks the same sequence
+        self.sort_key = make_sort_key(sort, dirs_first)
+        self.workers = workers
+        self.snapshot = snapshot
+        # A pool passed in is shared with other scanners (batch runs) and is not shut down here
+        self.owns_executor = executor is None
+        self.executor = executor
+        if executor is None and workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.dirs_listed = 0
+        self.entries_listed = 0
+        self.stat_calls = 0  # Besides one scandir per listing: lstat per entry in metadata mode, stat per followed folder
+        self.readlink_calls = 0
+        self.list_errors = 0
+        self.sort_time = 0.0
+        self.profile = profile
+        if profile is not None:
+            profile.scanner = self
+        self.prefetched = 0
+        self.list_time = 0.0  # Sum of per-directory listing time, i.e. what a serial walk would wait
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = None
+
+    @staticmethod
+    def build_rules(exclude_files=(), exclude_patterns=None, use_gitignore=False):
+        patterns = DEFAULT_EXCLUDE_PATTERNS + list(exclude_patterns or [])
+        if use_gitignore:
+            patterns.append('.git/')
+        return ExclusionRules.from_patterns(patterns, names=exclude_files)
+
+    def new_root(self, dir_path):
+        self.root = os.path.abspath(dir_path)
+        self.root_real = os.path.realpath(dir_path)
+        if self.visited is not None:
+            stat = os.stat(dir_path)
+            self.visited[(stat.st_dev, stat.st_ino)] = os.path.abspath(dir_path)
+        if self.metadata:
+            stat = os.stat(dir_path)
+            return MetaNode(os.path.abspath(dir_path), True, 0, stat.st_mtime, stat.st_ino)
+        return TreeNode(os.path.abspath(dir_path), True)
+
+    def rules_for(self, dir_path):
+        if not self.dir_rules:
+            return self.rules
+        path = dir_path
+        while True:
+            rules = self.dir_rules.get(path)
+            if rules is not None:
+                return rules
+            parent = os.path.dirname(path)
+            if parent == path:
+                return self.rules
+            path = parent
+
+    def scan(self, dir_path):
+        # One directory read per folder; DirEntry.is_dir() reuses the type info from the listing
+        start = time.perf_counter()
+        dir_entries = None
+        try:
+            if self.metadata or self.file_sizes:
+                # Sizes and mtimes come from the DirEntry stat, which the snapshot does not keep
+                with os.scandir(dir_path) as entries:
+                    dir_entries = {entry.name: entry for entry in entries}
+                listing = [(name, entry.is_dir(), entry.is_symlink()) for name, entry in dir_entries.items()]
+            elif self.snapshot is not None:
+                listing = self.snapshot.list_dir(dir_path)
+            else:
+                with os.scandir(dir_path) as entries:
+                    listing = [(entry.name, entry.is_dir(), entry.is_symlink()) for entry in entries]
+        except OSError as e:
+            # One unreadable folder is marked in the output instead of ending the whole run
+            with self.lock:
+                self.list_errors += 1
+            return [ErrorNode(e)]
+
+        # is_dir() follows links, so a link only counts as a directory when it will be followed
+        if self.symlinks != 'follow' and any(is_link for _, _, is_link in listing):
+            if self.symlinks == 'skip':
+                listing = [entry for entry in listing if not entry[2]]
+            else:
+                listing = [(name, is_dir and not is_link, is_link) for name, is_dir, is_link in listing]
+
+        inherited = rules = self.rules_for(dir_path)
+        if self.use_gitignore and any(name == '.gitignore' and not is_dir for name, is_dir, _ in listing):
+            rules = rules.with_gitignore(os.path.join(dir_path, '.gitignore'))
+
+        # Excluded directories are dropped here, so they are never listed
+        listing = [entry for entry in listing if not rules.excludes(entry[0], entry[1])]
+        sort_time = 0.0
+        if self.sort_key is not None:
+            sort_start = time.perf_counter()
+            listing.sort(key=self.sort_key)  # Sort for consistent output
+            sort_time = time.perf_counter() - sort_start
 
-    if not os.path.isdir(dir_path):
-        result_lines.append(f"{dir_path} is not a valid directory.")
-        return result_lines
+        # Entries past the limit are only counted; no nodes are built for them
+        omitted = 0
+        if self.max_entries_per_dir is not None and len(listing) > self.max_entries_per_dir:
+            omitted = len(listing) - self.max_entries_per_dir
+            del listing[self.max_entries_per_dir:]
 
-    if exclude_files is None:
-        exclude_files = []
+        depth = self.depths.get(dir_path, 0)
+        at_max_depth = self.max_depth is not None and depth + 1 >= self.max_depth
+        # Names like __init__.py or index.js repeat across a tree; interning keeps one copy
+        if self.metadata:
+            nodes = [(MetaLinkNode if is_link else MetaNode)(sys.intern(name), is_dir,
+                                                             *entry_stat(dir_entries[name], is_dir))
+                     for name, is_dir, is_link in listing]
+            stat_calls = len(nodes)
+        elif dir_entries is not None:
+            # One lstat per file, none per folder
+            nodes = [(LinkNode if is_link else TreeNode)(sys.intern(name), True) if is_dir else
+                     (SizedLinkNode if is_link else SizedNode)(sys.intern(name), entry_stat(dir_entries[name], False)[0])
+                     for name, is_dir, is_link in listing]
+            stat_calls = sum(1 for _, is_dir, _ in listing if not is_dir)
+        else:
+            nodes = [(LinkNode if is_link else TreeNode)(sys.intern(name), is_dir) for name, is_dir, is_link in listing]
+            stat_calls = 0
+        readlink_calls = 0
+        dir_keys = {}
+        for index, (node, (_, _, is_link)) in enumerate(zip(nodes, listing)):
+            if is_link:
+                readlink_calls += 1
+                try:
+                    node.target = os.readlink(os.path.join(dir_path, node.name))
+                except OSError:
+                    node.target = '?'
+            if not node.is_dir:
+                continue
+            child_path = os.path.join(dir_path, node.name)
+            if at_max_depth:
+                node.children = self.count_unlisted(child_path, rules.child_rules(node.name))  # Shown, but never listed
+                continue
+            if self.visited is not None:
+                if is_link and self.root_real is not None:
+                    # A link into the root: the folder is listed at its own path, which has no
+                    # links in it, wherever the link sorts
+                    real_path = os.path.realpath(child_path)
+                    if real_path == self.root_real or real_path.startswith(self.root_real + os.sep):
+                        listed_at = os.path.relpath(real_path, self.root_real).replace(os.sep, '/')
+                        nodes[index] = (MetaAliasNode if self.metadata else AliasNode)(node, listed_at)
+                        continue
+                stat_calls += 1
+                try:
+                    stat = os.stat(child_path)
+                except OSError:
+                    node.children = []
+                    continue
+                dir_keys[child_path] = (stat.st_dev, stat.st_ino)  # Claimed in render order, see claim()
+            if self.max_depth is not None:
+                self.depths[child_path] = depth + 1
+            child_rules = rules.child_rules(node.name)
+            if child_rules is not inherited:
+                self.dir_rules[child_path] = child_rules
+        if omitted:
+            nodes.append(MoreEntriesNode(omitted))
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.dir_keys.update(dir_keys)
+            self.dirs_listed += 1
+            self.entries_listed += len(nodes)
+            self.stat_calls += stat_calls
+            self.readlink_calls += readlink_calls
+            self.list_time += elapsed
+            self.sort_time += sort_time
+            if self.profile is not None:
+                self.profile.record_dir(dir_path, elapsed)
+        return nodes
 
-    contents = [item for item in os.listdir(dir_path) if item not in exclude_files and not item.endswith('.pyc')]
-    contents = sorted(contents, key=lambda s: s.lower())  # Sort for consistent output
+    def prefetch(self, dir_path):
+        # Runs on the pool: list one directory, then queue its subdirectories so listings
+        # overlap while the renderer consumes them in sorted order
+        nodes = self.scan(dir_path)
+        with self.lock:
+            self.prefetched += len(nodes)
+            if self.remaining is not None and self.prefetched >= self.remaining:
+                return nodes  # Enough is listed to fill the entry budget, let the renderer drive the rest
+        for node in nodes:
+            # Followed links are left to the renderer, so a link cycle is never prefetched
+            if node.is_dir and node.children is None and not isinstance(node, (LinkNode, MetaLinkNode)):
+                node.children = self.executor.submit(self.prefetch, os.path.join(dir_path, node.name))
+        return nodes
+
+    def take_budget(self, children):
+        # Applied in render order, so the same entries are kept with or without the pool
+        has_more = bool(children) and isinstance(children[-1], MoreEntriesNode)
+        shown = len(children) - has_more
+        if shown > self.remaining:
+            omitted = shown - self.remaining + (children[-1].count if has_more else 0)
+            children = children[:self.remaining] + [MoreEntriesNode(omitted)]
+            shown = self.remaining
+        self.remaining -= shown
+        return children
+
+    def count_unlisted(self, dir_path, rules=None):
+        # A folder that is shown but not listed (depth limit, spent entry budget) gets a
+        # "… N more entries" line; one scandir without any stat counts what it holds
+        if rules is None:
+            rules = self.rules_for(dir_path)
+        try:
+            with os.scandir(dir_path) as entries:
+                count = sum(1 for entry in entries if not rules.excludes(entry.name, entry.is_dir()))
+        except OSError as e:
+            return [ErrorNode(e)]
+        return [MoreEntriesNode(count)] if count else []
+
+    def claim(self, children, dir_path):
+        # With --symlinks follow, the first path to reach a physical directory lists it and
+        # later ones become aliases. Claims are made on the renderer's side as listings are
+        # reached, so the owner does not depend on which prefetch finished first
+        if self.visited is None:
+            return children
+        for index, child in enumerate(children):
+            if not child.is_dir or isinstance(child, MoreEntriesNode):
+                continue
+            child_path = os.path.join(dir_path, child.name)
+            with self.lock:
+                key = self.dir_keys.pop(child_path, None)
+                if key is None:
+                    continue
+                owner = self.visited.setdefault(key, child_path)
+            if owner != child_path:
+                if child.children is not None and not isinstance(child.children, list):
+                    child.children.cancel()
+                listed_at = os.path.relpath(owner, self.root).replace(os.sep, '/') if self.root else owner
+                children[index] = (MetaAliasNode if isinstance(child, MetaNode) else AliasNode)(child, listed_at)
+        return children
+
+    def load_children(self, node, path, keep=True):
+        # Directories are listed the first time a renderer reaches them; keep=False lets a
+        # streaming walk drop each listing once it has been rendered
+        children = node.children
+        if isinstance(children, list):
+            return children
+
+        if self.remaining == 0:
+            # The total entry budget is spent, stop listing
+            if children is not None:
+                children.cancel()
+            children = self.count_unlisted(path)
+        elif children is None:
+            if self.executor is not None:
+                children = self.prefetch(path)
+            else:
+                children = self.scan(path)
+        else:
+            children = children.result()
+
+        if self.remaining is not None:
+            children = self.take_budget(children)
+        children = self.claim(children, path)
+        node.children = children if keep else None
+        return children
+
+def scan_tree(dir_path, exclude_files=None, scanner=None, tree=None):
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files)
+
+    # Folders are listed in render order (children pushed reversed, as in iter_tree_lines), so
+    # a --max-total-entries budget is charged to the same entries with or without the pre-pass
+    root = tree if tree is not None else scanner.new_root(dir_path)
+    stack = [(root, dir_path)]
+    while stack:
+        node, path = stack.pop()
+        children = scanner.load_children(node, path)
+        stack.extend((child, os.path.join(path, child.name)) for child in reversed(children) if child.is_dir)
+    return root
+
+def iter_tree_lines(dir_path, prefix='', exclude_files=None, is_root=True, tree=None, keep_tree=False, scanner=None):
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files)
+
+    if tree is None:
+        if not os.path.isdir(dir_path):
+            yield f"{dir_path} is not a valid directory."
+            return
+        tree = scanner.new_root(dir_path)
+
+    metadata = scanner.metadata
+    if metadata and tree.children is None:
+        # Folder totals are only known once the whole subtree has been listed
+        scan_tree(dir_path, scanner=scanner, tree=tree)
+        compute_totals(tree)
 
     if is_root:
-        result_lines.append(os.path.abspath(dir_path))  # Add the top-level directory path
+        yield tree.name + (f" ({describe_entry(tree)})" if metadata else '')  # Add the top-level directory path
         prefix += '    '  # Increase the prefix for the next level
 
-    for index, item in enumerate(contents):
-        item_path = os.path.join(dir_path, item)
+    # Explicit stack of (siblings, next index, parent path, prefix) so depth is not
+    # bounded by the recursion limit
+    stack = [(scanner.load_children(tree, dir_path, keep_tree), 0, dir_path, prefix)]
+    while stack:
+        contents, index, path, prefix = stack.pop()
+        if index >= len(contents):
+            continue
+
+        item = contents[index]
         connector = '├── ' if index < len(contents) - 1 else '└── '
 
-        result_lines.append(prefix + connector + item)
-        if os.path.isdir(item_path):
+        if metadata and not isinstance(item, MoreEntriesNode):
+            yield f"{prefix}{connector}{display_name(item)} ({describe_entry(item)})"
+        else:
+            yield prefix + connector + display_name(item)
+        stack.append((contents, index + 1, path, prefix))
+        if item.is_dir:
+            item_path = os.path.join(path, item.name)
             next_prefix = prefix + ('│   ' if index < len(contents) - 1 else '    ')
-            generate_tree(item_path, next_prefix, exclude_files, is_root=False, result_lines=result_lines)
+            stack.append((scanner.load_children(item, item_path, keep_tree), 0, item_path, next_prefix))
+
+def iter_tree_entries(dir_path, tree=None, keep_tree=False, scanner=None):
+    # Yields (depth, relative path, node) in the same order as the TXT lines, starting with the
+    # root at depth 0. A truncated listing is reported with its parent folder's path
+    if scanner is None:
+        scanner = DirectoryScanner()
+    if tree is None:
+        tree = scanner.new_root(dir_path)
+    if scanner.metadata and tree.children is None:
+        scan_tree(dir_path, scanner=scanner, tree=tree)
+        compute_totals(tree)
+
+    yield 0, '.', tree
+    stack = [(scanner.load_children(tree, dir_path, keep_tree), 0, dir_path, '', 1)]
+    while stack:
+        contents, index, path, rel_path, depth = stack.pop()
+        if index >= len(contents):
+            continue
+
+        item = contents[index]
+        stack.append((contents, index + 1, path, rel_path, depth))
+        if isinstance(item, MoreEntriesNode):
+            yield depth, rel_path or '.', item
+            continue
+        item_rel_path = f"{rel_path}/{item.name}" if rel_path else item.name
+        yield depth, item_rel_path, item
+        if item.is_dir:
+            item_path = os.path.join(path, item.name)
+            stack.append((scanner.load_children(item, item_path, keep_tree), 0, item_path, item_rel_path, depth + 1))
+
+async def aiter_tree_entries(dir_path, tree=None, keep_tree=False, scanner=None, concurrency=4, executor=None,
+                             timeout=None):
+    # Async version of iter_tree_entries for use inside an event loop. Listings run on a thread
+    # pool (executor, or a private one), at most `concurrency` at a time per walk; when a folder's
+    # entries are reached, all of its subfolders are queued so their listings overlap with the
+    # consumer. timeout bounds the whole walk and raises asyncio.TimeoutError. Cancelling the
+    # consumer, or closing the iterator early, cancels the listings still queued
+    import asyncio
+
+    if scanner is None:
+        scanner = DirectoryScanner()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    own_executor = executor is None
+    if own_executor:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    queued = set()
+
+    async def in_pool(function, path):
+        # Everything that touches the filesystem runs on the pool, never on the loop's thread
+        async with semaphore:
+            return await loop.run_in_executor(executor, function, path)
+
+    def time_left():
+        return None if deadline is None else max(deadline - loop.time(), 0)
+
+    def queue(node, path):
+        if node.children is not None:
+            return None
+        task = asyncio.ensure_future(in_pool(scanner.scan, path))
+        queued.add(task)
+        task.add_done_callback(queued.discard)
+        return task
+
+    async def load_children(node, path, task, keep):
+        # Same rules as DirectoryScanner.load_children, awaiting the queued listing
+        children = node.children
+        if isinstance(children, list):
+            return children
+        if scanner.remaining == 0:
+            if task is not None:
+                task.cancel()
+            children = await asyncio.wait_for(in_pool(scanner.count_unlisted, path), time_left())
+        else:
+            if task is None:
+                task = queue(node, path)
+            children = await asyncio.wait_for(task, time_left())
+        if scanner.remaining is not None:
+            children = scanner.take_budget(children)
+        children = scanner.claim(children, path)
+        node.children = children if keep else None
+        return children
 
+    async def walk(keep):
+        contents = await load_children(tree, dir_path, None, keep)
+        stack = [(contents, [queue(child, os.path.join(dir_path, child.name)) if child.is_dir else None
+                             for child in contents], 0, dir_path, '', 1)]
+        while stack:
+            contents, tasks, index, path, rel_path, depth = stack.pop()
+            if index >= len(contents):
+                continue
+
+            item = contents[index]
+            stack.append((contents, tasks, index + 1, path, rel_path, depth))
+            if isinstance(item, MoreEntriesNode):
+                yield depth, rel_path or '.', item
+                continue
+            item_rel_path = f"{rel_path}/{item.name}" if rel_path else item.name
+            yield depth, item_rel_path, item
+            if item.is_dir:
+                item_path = os.path.join(path, item.name)
+                children = await load_children(item, item_path, tasks[index], keep)
+                child_tasks = [queue(child, os.path.join(item_path, child.name)) if child.is_dir else None
+                               for child in children]
+                stack.append((children, child_tasks, 0, item_path, item_rel_path, depth + 1))
+
+    try:
+        if tree is None:
+            # new_root stats the root in metadata and follow mode
+            tree = await asyncio.wait_for(in_pool(scanner.new_root, dir_path), time_left())
+        if scanner.metadata and tree.children is None:
+            # Folder totals need the whole subtree first, as in iter_tree_entries
+            async for _ in walk(True):
+                pass
+            compute_totals(tree)
+        yield 0, '.', tree
+        async for entry in walk(keep_tree):
+            yield entry
+    finally:
+        for task in list(queued):
+            task.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def generate_tree(dir_path, prefix='', exclude_files=None, is_root=True, result_lines=None, tree=None, scanner=None,
+                  max_depth=None, max_entries_per_dir=None, max_total_entries=None):
+    if result_lines is None:
+        result_lines = []
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files, max_depth=max_depth, max_entries_per_dir=max_entries_per_dir,
+                                   max_total_entries=max_total_entries)
+    result_lines.extend(iter_tree_lines(dir_path, prefix, exclude_files, is_root, tree, scanner=scanner))
     return result_lines
 
-def generate_html_tree(dir_path, exclude_files=None):
-    if not os.path.isdir(dir_path):
-        return "<p>Invalid directory.</p>"
-
-    if exclude_files is None:
-        exclude_files = []
-
-    icon_mapping = {
-        "folder": "📁",
-        ".py": "🐍",
-        ".cs": "💻",
-        ".html": "🌐",
-        ".css": "🎨",
-        ".js": "📜",
-        ".json": "🔧",
-        ".md": "📄",
-        ".txt": "📄",
-        "default": "📄"
-    }
-
-    def get_icon(file_name):
-        _, ext = os.path.splitext(file_name)
-        return icon_mapping.get(ext, icon_mapping["default"])
-
-    def get_html_list(path, exclude_files, is_root=False):
-        contents = [item for item in os.listdir(path) if item not in exclude_files and not item.endswith('.pyc')]
-        contents = sorted(contents, key=lambda s: s.lower())
-        folders = [item for item in contents if os.path.isdir(os.path.join(path, item))]
-        files = [item for item in contents if not os.path.isdir(os.path.join(path, item))]
-
-        html = '<ul class="nested">'
-        for folder in folders:
-            item_path = os.path.join(path, folder)
-            html += f'<li class="folder"><span>{icon_mapping["folder"]} {folder}</span>{get_html_list(item_path, exclude_files, is_root=False)}</li>'
-
-        for file in files:
-            html += f'<li class="file"><span>{get_icon(file)} {file}</span></li>'
-        html += '</ul>'
-        return html
-
-    top_level_dir = os.path.abspath(dir_path)
-    html_structure = get_html_list(dir_path, exclude_files, is_root=True)
-    return f"""
+def write_tree_lines(lines, out_file):
+    # Lines are written as the walk produces them, so memory does not grow with the tree
+    count = 0
+    for line in lines:
+        out_file.write(line if count == 0 else '\n' + line)
+        count += 1
+    return count
+
+def entry_type(node):
+    if isinstance(node, ErrorNode):
+        return 'error'
+    if isinstance(node, MoreEntriesNode):
+        return 'more'
+    if getattr(node, 'target', None) is not None:
+        return 'symlink'
+    return 'dir' if node.is_dir else 'file'
+
+def add_link_fields(record, node):
+    for field in ('target', 'listed_at'):
+        value = getattr(node, field, None)
+        if value is not None:
+            record[field] = value
+
+def write_tree_jsonl(entries, out_file):
+    # One JSON object per line, written as the walk goes
+    write = out_file.write
+    count = 0
+    for depth, rel_path, node in entries:
+        record = {'path': rel_path, 'depth': depth, 'type': entry_type(node), 'size': getattr(node, 'size', None)}
+        if isinstance(node, ErrorNode):
+            record['error'] = node.reason
+        elif isinstance(node, MoreEntriesNode):
+            record['count'] = node.count
+        else:
+            add_link_fields(record, node)
+        write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+def write_tree_csv(entries, out_file):
+    import csv
+
+    writer = csv.writer(out_file, lineterminator='\n')
+    writer.writerow(['path', 'depth', 'type', 'size', 'count'])
+    count = 0
+    for depth, rel_path, node in entries:
+        size = getattr(node, 'size', None)
+        node_type = entry_type(node)
+        writer.writerow([rel_path, depth, node_type, '' if size is None else size,
+                         node.count if node_type == 'more' else ''])
+        count += 1
+    return count
+
+def write_tree_json_nested(entries, out_file):
+    # Nested objects streamed from the pre-order walk: a folder's children array is closed as
+    # soon as the walk moves back above it, so only the open folders are tracked
+    write = out_file.write
+    open_dirs = 0
+    need_comma = False
+    count = 0
+    for depth, rel_path, node in entries:
+        while open_dirs > depth:
+            write(']}')
+            open_dirs -= 1
+            need_comma = True
+        if need_comma:
+            write(',')
+        if isinstance(node, ErrorNode):
+            record = {'type': 'error', 'error': node.reason}
+        elif isinstance(node, MoreEntriesNode):
+            record = {'type': 'more', 'count': node.count}
+        else:
+            record = {'name': node.name, 'type': entry_type(node), 'size': getattr(node, 'size', None)}
+            add_link_fields(record, node)
+        text = json.dumps(record, ensure_ascii=False)
+        if node.is_dir and not isinstance(node, MoreEntriesNode):
+            write(text[:-1] + ', "children": [')
+            open_dirs += 1
+            need_comma = False
+        else:
+            write(text)
+            need_comma = True
+        count += 1
+    write(']}' * open_dirs + '\n')
+    return count
+
+SEARCH_INDEX_VERSION = 1
+
+def build_search_index(entries):
+    # Every distinct name is stored once, sorted case-insensitively. Entries are numbered in
+    # tree order and keep their name id and parent id; order lists them grouped by name, with
+    # starts[name id] the offset of each group, so a lookup only touches the matching names
+    name_ids = {}
+    parents = array('i')
+    entry_names = array('i')
+    dirs = []
+    open_ids = [-1]  # Id of the folder open at each depth; -1 is the root
+    root = None
+    for depth, rel_path, node in entries:
+        if depth == 0:
+            root = node.name
+            continue
+        if isinstance(node, MoreEntriesNode):
+            continue
+        entry_id = len(parents)
+        del open_ids[depth:]
+        parents.append(open_ids[depth - 1])
+        entry_names.append(name_ids.setdefault(node.name, len(name_ids)))
+        dirs.append('1' if node.is_dir else '0')
+        if node.is_dir:
+            open_ids.append(entry_id)
+
+    names = sorted(name_ids, key=lambda name: (name.casefold(), name))
+    remap = array('i', [0]) * len(names)
+    for name_id, name in enumerate(names):
+        remap[name_ids[name]] = name_id
+    entry_names = [remap[name_id] for name_id in entry_names]
+
+    # Counting sort by name id keeps tree order within each name
+    starts = [0] * (len(names) + 1)
+    for name_id in entry_names:
+        starts[name_id + 1] += 1
+    for name_id in range(len(names)):
+        starts[name_id + 1] += starts[name_id]
+    fill = starts[:-1]
+    order = [0] * len(entry_names)
+    for entry_id, name_id in enumerate(entry_names):
+        order[fill[name_id]] = entry_id
+        fill[name_id] += 1
+
+    return {'version': SEARCH_INDEX_VERSION, 'root': root, 'names': names, 'name_ids': entry_names,
+            'parents': parents.tolist(), 'dirs': ''.join(dirs), 'order': order, 'starts': starts}
+
+def write_search_index(entries, out_file):
+    index = build_search_index(entries)
+    json.dump(index, out_file, ensure_ascii=False, separators=(',', ':'))
+    return len(index['parents'])
+
+class SearchIndex:
+    # Answers name queries from an index file without touching the filesystem
+    def __init__(self, data):
+        if data.get('version') != SEARCH_INDEX_VERSION:
+            raise ValueError(f"unsupported search index version {data.get('version')}")
+        self.root = data['root']
+        self.names = data['names']
+        self.name_ids = data['name_ids']
+        self.parents = data['parents']
+        self.dirs = data['dirs']
+        self.order = data['order']
+        self.starts = data['starts']
+        self.folded = [name.casefold() for name in self.names]
+
+    @classmethod
+    def load(cls, index_path):
+        with open_input(index_path) as index_file:
+            return cls(json.load(index_file))
+
+    def match_names(self, query, mode='substring'):
+        query = query.casefold()
+        if mode == 'exact':
+            # Names are sorted by their casefolded form, so equal names are adjacent
+            start = bisect.bisect_left(self.folded, query)
+            end = bisect.bisect_right(self.folded, query)
+            return range(start, end)
+        if mode == 'glob':
+            regex = re.compile(fnmatch.translate(query))
+            return [name_id for name_id, name in enumerate(self.folded) if regex.match(name)]
+        return [name_id for name_id, name in enumerate(self.folded) if query in name]
+
+    def find(self, query, mode='substring', kind=None):
+        # Entry ids in tree order
+        entry_ids = []
+        for name_id in self.match_names(query, mode):
+            entry_ids.extend(self.order[self.starts[name_id]:self.starts[name_id + 1]])
+        if kind is not None:
+            flag = '1' if kind == 'dir' else '0'
+            entry_ids = [entry_id for entry_id in entry_ids if self.dirs[entry_id] == flag]
+        entry_ids.sort()
+        return entry_ids
+
+    def path(self, entry_id):
+        parts = []
+        while entry_id != -1:
+            parts.append(self.names[self.name_ids[entry_id]])
+            entry_id = self.parents[entry_id]
+        return '/'.join(reversed(parts))
+
+MACHINE_WRITERS = {
+    'jsonl': write_tree_jsonl,
+    'json': write_tree_json_nested,
+    'csv': write_tree_csv,
+    'index': write_search_index,
+}
+
+FORMAT_EXTENSIONS = {'index': '.index.json'}  # Others use the format name
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+def load_zstandard():
+    try:
+        import zstandard  # Optional, only needed for .zst output and input
+    except ImportError:
+        return None
+    return zstandard
+
+def open_output(path, compression=None):
+    # Compressed files are encoded as they are written, so large outputs never sit in memory
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+    if compression == 'zstd':
+        zstandard = load_zstandard()
+        if zstandard is None:
+            raise RuntimeError("zstd output needs the 'zstandard' package")
+        raw = open(path, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding='utf-8')
+    return open(path, 'w', encoding='utf-8', buffering=1024 * 1024)
+
+def open_input(path):
+    # Reads back what open_output wrote, picking the decompressor from the file suffix
+    if path.endswith('.gz'):
+        import gzip
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        zstandard = load_zstandard()
+        if zstandard is None:
+            raise RuntimeError("reading .zst files needs the 'zstandard' package")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+ICON_MAPPING = {
+    "folder": "📁",
+    ".py": "🐍",
+    ".cs": "💻",
+    ".html": "🌐",
+    ".css": "🎨",
+    ".js": "📜",
+    ".json": "🔧",
+    ".md": "📄",
+    ".txt": "📄",
+    "default": "📄"
+}
+
+def get_icon(file_name):
+    _, ext = os.path.splitext(file_name)
+    return ICON_MAPPING.get(ext, ICON_MAPPING["default"])
+
+# Search box shared by both HTML viewers. The page embeds the same index as the .index.json
+# output; each viewer defines revealPath(parts) to open and highlight a result
+SEARCH_STYLE = """
+            .search {
+                margin: 10px 0;
+            }
+            .search input {
+                width: 320px;
+            }
+            #search-results {
+                max-height: 240px;
+                overflow-y: auto;
+                margin: 5px 0;
+            }
+            #search-results li {
+                cursor: pointer;
+            }
+            .hit {
+                background: #ffef9e;
+            }"""
+
+SEARCH_BOX = """        <div class="search">
+            <input id="search" type="search" placeholder="Search names, e.g. util or *.py">
+            <span id="search-count"></span>
+            <ol id="search-results"></ol>
+        </div>
+"""
+
+SEARCH_SCRIPT = r"""        <script>
+            const searchIndex = window.SEARCH_INDEX || JSON.parse(document.getElementById('search-index').textContent);
+            const foldedNames = searchIndex.names.map(name => name.toLowerCase());
+            const SEARCH_LIMIT = 200;
+
+            function entryParts(entryId) {
+                const parts = [];
+                for (let id = entryId; id !== -1; id = searchIndex.parents[id]) {
+                    parts.push(searchIndex.names[searchIndex.name_ids[id]]);
+                }
+                return parts.reverse();
+            }
+
+            function globToRegExp(glob) {
+                let source = '';
+                for (const char of glob) {
+                    source += char === '*' ? '.*' : char === '?' ? '.' : char.replace(/[.+^${}()|[\]\\]/g, '\\$&');
+                }
+                return new RegExp('^' + source + '$');
+            }
+
+            // Only the distinct names are tested; the entries of a matching name come from its group
+            function search(query) {
+                query = query.trim().toLowerCase();
+                const ids = [];
+                let total = 0;
+                if (!query) {
+                    return { ids: ids, total: total };
+                }
+                const regex = /[*?]/.test(query) ? globToRegExp(query) : null;
+                foldedNames.forEach((name, nameId) => {
+                    if (regex ? regex.test(name) : name.includes(query)) {
+                        const start = searchIndex.starts[nameId];
+                        const end = searchIndex.starts[nameId + 1];
+                        total += end - start;
+                        for (let i = start; i < end && ids.length < SEARCH_LIMIT; i++) {
+                            ids.push(searchIndex.order[i]);
+                        }
+                    }
+                });
+                ids.sort((a, b) => a - b);
+                return { ids: ids, total: total };
+            }
+
+            const searchBox = document.getElementById('search');
+            const searchResults = document.getElementById('search-results');
+            const searchCount = document.getElementById('search-count');
+            let searchTimer = null;
+            searchBox.addEventListener('input', () => {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => {
+                    const result = search(searchBox.value);
+                    const fragment = document.createDocumentFragment();
+                    result.ids.forEach(id => {
+                        const li = document.createElement('li');
+                        li.textContent = entryParts(id).join('/');
+                        li.dataset.id = id;
+                        fragment.appendChild(li);
+                    });
+                    searchResults.replaceChildren(fragment);
+                    searchCount.textContent = searchBox.value.trim() ? result.total + (result.total === 1 ? ' match' : ' matches') : '';
+                }, 150);
+            });
+            searchResults.addEventListener('click', event => {
+                const li = event.target.closest('li');
+                if (li) {
+                    revealPath(entryParts(Number(li.dataset.id)));
+                }
+            });
+        </script>
+"""
+
+def search_index_json(tree, dir_path, scanner):
+    # The same text as the .index.json file, so a run writing both builds the index only once
+    index = build_search_index(iter_tree_entries(dir_path, tree=tree, keep_tree=True, scanner=scanner))
+    return json.dumps(index, ensure_ascii=False, separators=(',', ':'))
+
+def html_search_index(tree, dir_path, scanner, search_index=None):
+    # The tree is already loaded by the renderer, so this does not list anything again
+    if search_index is None:
+        search_index = search_index_json(tree, dir_path, scanner)
+    return search_index.replace('</', '<\\/')
+
+def write_html_list(tree, dir_path, out_file, exclude_files=None, scanner=None):
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files)
+
+    # Fragments are written once, in document order, from an explicit stack: either a
+    # closing tag to emit or a (node, path) whose <ul> still has to be opened
+    def meta(node):
+        return f'<span class="meta">({describe_entry(node)})</span>' if scanner.metadata else ''
+
+    write = out_file.write
+    stack = [(tree, dir_path)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            write(item)
+            continue
+
+        node, path = item
+        folders = []
+        files = []
+        more = ''
+        for child in scanner.load_children(node, path):
+            if isinstance(child, MoreEntriesNode):
+                more = f'<li class="more"><span>{child.name}</span></li>'
+            else:
+                (folders if child.is_dir else files).append(child)
+
+        write('<ul class="nested">')
+        stack.append('</ul>')
+        stack.append(''.join(f'<li class="file"><span>{get_icon(file.name)} {display_name(file)}</span>{meta(file)}</li>' for file in files) + more)
+        for folder in reversed(folders):
+            stack.append('</li>')
+            stack.append((folder, os.path.join(path, folder.name)))
+            stack.append(f'<li class="folder"><span>{ICON_MAPPING["folder"]} {display_name(folder)}</span>{meta(folder)}')
+
+def write_html_tree(dir_path, out_file, exclude_files=None, tree=None, scanner=None, search_index=None):
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files)
+
+    if tree is None:
+        if not os.path.isdir(dir_path):
+            out_file.write("<p>Invalid directory.</p>")
+            return
+        tree = scanner.new_root(dir_path)
+
+    top_level_meta = ''
+    if scanner.metadata:
+        if tree.children is None:
+            scan_tree(dir_path, scanner=scanner, tree=tree)
+            compute_totals(tree)
+        top_level_meta = f'<span class="meta">({describe_entry(tree)})</span>'
+
+    top_level_dir = tree.name
+    out_file.write(f"""
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -114,22 +1519,32 @@ def generate_html_tree(dir_path, exclude_files=None):
             .active > .nested {{
                 display: block;
             }}
+            .meta {{
+                color: #666;
+                font-size: 0.9em;
+            }}
+            .more > span {{
+                color: #888;
+                font-style: italic;
+            }}
             .buttons {{
                 margin: 10px 0;
             }}
             .buttons button {{
                 margin-right: 10px;
-            }}
+            }}{SEARCH_STYLE}
         </style>
     </head>
     <body>
         <h1>Directory Structure of {os.path.basename(dir_path)}</h1>
-        <div class="top-level"><span>{icon_mapping["folder"]} {top_level_dir}</span></div>
+        <div class="top-level"><span>{ICON_MAPPING["folder"]} {top_level_dir}</span>{top_level_meta}</div>
         <div class="buttons">
             <button onclick="expandAll()">Expand All</button>
             <button onclick="collapseAll()">Collapse All</button>
         </div>
-        <div>{html_structure}</div>
+{SEARCH_BOX}        <div id="tree-list">""")
+    write_html_list(tree, dir_path, out_file, exclude_files, scanner)
+    out_file.write(f"""</div>
         <script>
             document.querySelectorAll('.folder > span').forEach(span => {{
                 span.addEventListener('click', function() {{
@@ -148,71 +1563,1244 @@ def generate_html_tree(dir_path, exclude_files=None):
                     folder.classList.remove('active');
                 }});
             }}
+
+            // Labels are "icon name", or "icon name -> target" for links
+            function matchesName(text, name) {{
+                const label = text.slice(text.indexOf(' ') + 1);
+                return label === name || label.startsWith(name + ' -> ');
+            }}
+
+            function revealPath(parts) {{
+                let list = document.getElementById('tree-list').firstElementChild;
+                let found = null;
+                for (const name of parts) {{
+                    found = null;
+                    for (const li of list ? list.children : []) {{
+                        if (li.firstElementChild && matchesName(li.firstElementChild.textContent, name)) {{
+                            found = li;
+                            break;
+                        }}
+                    }}
+                    if (!found) {{
+                        return;
+                    }}
+                    if (found.classList.contains('folder')) {{
+                        found.classList.add('active');
+                        list = found.querySelector(':scope > ul');
+                    }}
+                }}
+                const span = found.firstElementChild;
+                span.scrollIntoView({{ block: 'center' }});
+                span.classList.add('hit');
+                setTimeout(() => span.classList.remove('hit'), 2000);
+            }}
         </script>
-    </body>
+        <script type="application/json" id="search-index">{html_search_index(tree, dir_path, scanner, search_index)}</script>
+{SEARCH_SCRIPT}    </body>
     </html>
-    """
+    """)
 
-def get_unique_folder_name(path, base_name):
+def generate_html_tree(dir_path, exclude_files=None, tree=None, scanner=None,
+                       max_depth=None, max_entries_per_dir=None, max_total_entries=None):
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files, max_depth=max_depth, max_entries_per_dir=max_entries_per_dir,
+                                   max_total_entries=max_total_entries)
+    html_file = io.StringIO()
+    write_html_tree(dir_path, html_file, exclude_files, tree, scanner)
+    return html_file.getvalue()
+
+def json_name(name):
+    # Safe to embed inside a <script> element
+    return json.dumps(name, ensure_ascii=False).replace('</', '<\\/')
+
+def write_tree_json(tree, dir_path, out_file, exclude_files=None, scanner=None):
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files)
+
+    # Compact nested arrays: a folder is [name, [children]], a file is its name and a
+    # truncated listing is the number of omitted entries. Folders come first, as in the list view
+    write = out_file.write
+    stack = [(tree, dir_path)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            write(item)
+            continue
+
+        node, path = item
+        folders = []
+        files = []
+        for child in scanner.load_children(node, path):
+            if isinstance(child, ErrorNode):
+                files.append(json_name(child.name))
+            elif isinstance(child, MoreEntriesNode):
+                files.append(str(child.count))
+            elif child.is_dir:
+                folders.append(child)
+            else:
+                files.append(json_name(display_name(child)))
+
+        write('[')
+        stack.append(']')
+        if files:
+            stack.append((',' if folders else '') + ','.join(files))
+        for index in reversed(range(len(folders))):
+            folder = folders[index]
+            stack.append(']')
+            stack.append((folder, os.path.join(path, folder.name)))
+            stack.append(f'{"," if index else ""}[{json_name(display_name(folder))},')
+
+def write_html_viewer(dir_path, out_file, exclude_files=None, tree=None, scanner=None, data_path=None,
+                      search_index=None):
+    # Lazy viewer: the tree is shipped as JSON and only the rows scrolled into view exist in
+    # the DOM. With data_path the JSON goes to a sidecar script next to the HTML file
+    if scanner is None:
+        scanner = DirectoryScanner(exclude_files)
+
+    if tree is None:
+        if not os.path.isdir(dir_path):
+            out_file.write("<p>Invalid directory.</p>")
+            return
+        tree = scanner.new_root(dir_path)
+
+    if data_path is not None:
+        temp_path = data_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8', buffering=1024 * 1024) as data_file:
+            data_file.write('window.TREE_DATA = ')
+            write_tree_json(tree, dir_path, data_file, exclude_files, scanner)
+            data_file.write(';\nwindow.SEARCH_INDEX = ' + html_search_index(tree, dir_path, scanner, search_index) + ';')
+        os.replace(temp_path, data_path)
+
+    top_level_dir = tree.name
+    out_file.write(f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Directory Structure</title>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+            }}
+            span {{
+                display: inline-block;
+                margin-left: 5px;
+            }}
+            .top-level {{
+                font-weight: bold;
+                font-size: 1.2em;
+            }}
+            .buttons {{
+                margin: 10px 0;
+            }}
+            .buttons button {{
+                margin-right: 10px;
+            }}
+            #tree {{
+                height: calc(100vh - 160px);
+                overflow-y: auto;
+                position: relative;
+            }}
+            #rows {{
+                position: absolute;
+                left: 0;
+                right: 0;
+            }}
+            .row {{
+                height: 22px;
+                line-height: 22px;
+                white-space: nowrap;
+            }}
+            .row.folder {{
+                cursor: pointer;
+            }}
+            .row.more {{
+                color: #888;
+                font-style: italic;
+            }}{SEARCH_STYLE}
+        </style>
+    </head>
+    <body>
+        <h1>Directory Structure of {os.path.basename(dir_path)}</h1>
+        <div class="top-level"><span>{ICON_MAPPING["folder"]} {top_level_dir}</span></div>
+        <div class="buttons">
+            <button onclick="expandAll()">Expand All</button>
+            <button onclick="collapseAll()">Collapse All</button>
+        </div>
+{SEARCH_BOX}        <div id="tree"><div id="spacer"></div><div id="rows"></div></div>
+""")
+    if data_path is not None:
+        out_file.write(f'        <script src="{os.path.basename(data_path)}"></script>\n')
+    else:
+        out_file.write('        <script type="application/json" id="tree-data">')
+        write_tree_json(tree, dir_path, out_file, exclude_files, scanner)
+        out_file.write('</script>\n')
+        out_file.write(f'        <script type="application/json" id="search-index">{html_search_index(tree, dir_path, scanner, search_index)}</script>\n')
+    out_file.write(f"""        <script>
+            const ICONS = {json.dumps(ICON_MAPPING, ensure_ascii=False)};
+            const ROW_HEIGHT = 22;
+            const data = window.TREE_DATA || JSON.parse(document.getElementById('tree-data').textContent);
+            const tree = document.getElementById('tree');
+            const spacer = document.getElementById('spacer');
+            const rowsBox = document.getElementById('rows');
+            let rows = [];
+            let pending = false;
+            let highlighted = -1;
+
+            function isFolder(item) {{
+                return Array.isArray(item);
+            }}
+
+            function label(item) {{
+                if (typeof item === 'number') {{
+                    return '… ' + item + (item === 1 ? ' more entry' : ' more entries');
+                }}
+                if (isFolder(item)) {{
+                    return ICONS['folder'] + ' ' + item[0];
+                }}
+                const dot = item.lastIndexOf('.');
+                const ext = dot > 0 ? item.slice(dot) : '';
+                return (ICONS[ext] || ICONS['default']) + ' ' + item;
+            }}
+
+            function childRows(item, depth) {{
+                return item[1].map(child => ({{ item: child, depth: depth, open: false }}));
+            }}
+
+            // Only the rows inside the viewport are turned into DOM nodes
+            function render() {{
+                pending = false;
+                spacer.style.height = (rows.length * ROW_HEIGHT) + 'px';
+                const first = Math.floor(tree.scrollTop / ROW_HEIGHT);
+                const last = Math.min(rows.length, first + Math.ceil(tree.clientHeight / ROW_HEIGHT) + 1);
+                rowsBox.style.top = (first * ROW_HEIGHT) + 'px';
+                const fragment = document.createDocumentFragment();
+                for (let index = first; index < last; index++) {{
+                    const row = rows[index];
+                    const div = document.createElement('div');
+                    div.className = 'row ' + (isFolder(row.item) ? 'folder' : typeof row.item === 'number' ? 'more' : 'file');
+                    div.style.paddingLeft = (row.depth * 20) + 'px';
+                    div.dataset.index = index;
+                    if (index === highlighted) {{
+                        div.classList.add('hit');
+                    }}
+                    const span = document.createElement('span');
+                    span.textContent = label(row.item);
+                    div.appendChild(span);
+                    fragment.appendChild(div);
+                }}
+                rowsBox.replaceChildren(fragment);
+            }}
+
+            function scheduleRender() {{
+                if (!pending) {{
+                    pending = true;
+                    requestAnimationFrame(render);
+                }}
+            }}
+
+            function toggle(index) {{
+                highlighted = -1;
+                const row = rows[index];
+                if (!isFolder(row.item)) {{
+                    return;
+                }}
+                if (row.open) {{
+                    let end = index + 1;
+                    while (end < rows.length && rows[end].depth > row.depth) {{
+                        end++;
+                    }}
+                    rows.splice(index + 1, end - index - 1);
+                }} else {{
+                    rows = rows.slice(0, index + 1).concat(childRows(row.item, row.depth + 1), rows.slice(index + 1));
+                }}
+                row.open = !row.open;
+                scheduleRender();
+            }}
+
+            // One delegated handler for every row
+            tree.addEventListener('click', event => {{
+                const row = event.target.closest('.row');
+                if (row) {{
+                    toggle(Number(row.dataset.index));
+                }}
+            }});
+            tree.addEventListener('scroll', scheduleRender);
+            window.addEventListener('resize', scheduleRender);
+
+            function expandAll() {{
+                const expanded = [];
+                const stack = [[data, 0, 0]];
+                while (stack.length) {{
+                    const frame = stack[stack.length - 1];
+                    const children = frame[0];
+                    if (frame[1] >= children.length) {{
+                        stack.pop();
+                        continue;
+                    }}
+                    const item = children[frame[1]++];
+                    expanded.push({{ item: item, depth: frame[2], open: isFolder(item) }});
+                    if (isFolder(item)) {{
+                        stack.push([item[1], 0, frame[2] + 1]);
+                    }}
+                }}
+                rows = expanded;
+                scheduleRender();
+            }}
+
+            function collapseAll() {{
+                rows = data.map(item => ({{ item: item, depth: 0, open: false }}));
+                tree.scrollTop = 0;
+                scheduleRender();
+            }}
+
+            // Opens each folder on the path in the row model, then scrolls to the entry
+            function revealPath(parts) {{
+                let index = -1;
+                for (let depth = 0; depth < parts.length; depth++) {{
+                    const parent = index;
+                    if (parent >= 0 && !rows[parent].open) {{
+                        toggle(parent);
+                    }}
+                    index = -1;
+                    for (let i = parent + 1; i < rows.length && rows[i].depth >= depth; i++) {{
+                        const item = rows[i].item;
+                        if (rows[i].depth !== depth || typeof item === 'number') {{
+                            continue;
+                        }}
+                        const name = isFolder(item) ? item[0] : item;
+                        if (name === parts[depth] || name.startsWith(parts[depth] + ' -> ')) {{
+                            index = i;
+                            break;
+                        }}
+                    }}
+                    if (index < 0) {{
+                        return;
+                    }}
+                }}
+                highlighted = index;
+                tree.scrollTop = Math.max(0, index * ROW_HEIGHT - tree.clientHeight / 2);
+                scheduleRender();
+            }}
+
+            collapseAll();
+        </script>
+{SEARCH_SCRIPT}    </body>
+    </html>
+    """)
+
+class DiffNode(TreeNode):
+    # An entry of a diff tree; the change marker is part of the name so the TXT and HTML
+    # renderers show it as is
+    __slots__ = ('status',)
+    MARKERS = {'added': '[+] ', 'removed': '[-] ', 'modified': '[~] ', 'touched': '[~] '}
+    SUFFIXES = {'touched': ' (mtime only)'}
+
+    def __init__(self, name, is_dir, status=None):
+        super().__init__(self.MARKERS.get(status, '') + name + self.SUFFIXES.get(status, ''), is_dir,
+                         [] if status else None)
+        self.status = status
+
+def open_diff_side(path, exclude_patterns=None, metadata=True, reference=None):
+    # A side is either a directory or a snapshot written by an earlier run. A directory
+    # compared with its own earlier snapshot (reference) reuses the snapshot listing of every
+    # folder whose mtime is unchanged, so those folders cost one stat. Anything else raises
+    # ValueError with a message for the user
+    if os.path.isfile(path):
+        try:
+            reader = SnapshotReader.open(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"{path} is not a readable snapshot file ({e})") from e
+        scanner = DirectoryScanner(snapshot=reader, exclude_patterns=exclude_patterns)
+        return scanner, TreeNode(reader.root, True), reader.root
+    if not os.path.isdir(path):
+        raise ValueError(f"{path} is neither a directory nor a snapshot file")
+    dir_path = os.path.abspath(path)
+    if reference is not None and reference.root == dir_path:
+        snapshot = TreeSnapshot(reference.root, reference.listings, reference.created_ns)
+        scanner = DirectoryScanner(snapshot=snapshot, exclude_patterns=exclude_patterns)
+    else:
+        scanner = DirectoryScanner(exclude_patterns=exclude_patterns, metadata=metadata)
+    return scanner, scanner.new_root(dir_path), dir_path
+
+def file_change(old, new):
+    # Returns 'modified', 'touched' (same size, different mtime and no digests to tell) or
+    # None. Links are compared by target only: their own mtime changes whenever they are
+    # copied. Sizes, mtimes and digests are only compared when both sides have them
+    old_target = getattr(old, 'target', None)
+    new_target = getattr(new, 'target', None)
+    if old_target is not None or new_target is not None:
+        return 'modified' if old_target != new_target else None
+    if not isinstance(old, MetaNode) or not isinstance(new, MetaNode):
+        return None
+    if old.size != new.size:
+        return 'modified'
+    if old.digest is not None and new.digest is not None:
+        return 'modified' if old.digest != new.digest else None
+    return 'touched' if old.mtime != new.mtime else None
+
+def diff_trees(old_side, new_side):
+    # Merge-walks the sorted listings of both sides level by level. Added and removed folders
+    # are reported once and not descended into, so the work follows the size of the change
+    old_scanner, old_root, old_path = old_side
+    new_scanner, new_root, new_path = new_side
+    diff_root = DiffNode(f"{old_root.name} -> {new_root.name}", True)
+    counts = {'added': 0, 'removed': 0, 'modified': 0, 'touched': 0}
+
+    def sort_key(node):
+        return node.name.lower(), node.name
+
+    stack = [(old_root, old_path, new_root, new_path, diff_root)]
+    while stack:
+        old_node, old_dir, new_node, new_dir, diff_node = stack.pop()
+        old_children = sorted((child for child in old_scanner.load_children(old_node, old_dir, keep=False)
+                               if not isinstance(child, MoreEntriesNode)), key=sort_key)
+        new_children = sorted((child for child in new_scanner.load_children(new_node, new_dir, keep=False)
+                               if not isinstance(child, MoreEntriesNode)), key=sort_key)
+
+        changes = []
+        i = j = 0
+        while i < len(old_children) or j < len(new_children):
+            old = old_children[i] if i < len(old_children) else None
+            new = new_children[j] if j < len(new_children) else None
+            if new is None or (old is not None and sort_key(old) < sort_key(new)):
+                changes.append(DiffNode(old.name, old.is_dir, 'removed'))
+                i += 1
+            elif old is None or sort_key(new) < sort_key(old):
+                changes.append(DiffNode(new.name, new.is_dir, 'added'))
+                j += 1
+            else:
+                if old.is_dir != new.is_dir:
+                    status = 'modified'
+                else:
+                    status = None if new.is_dir else file_change(old, new)
+                if status:
+                    changes.append(DiffNode(new.name, new.is_dir, status))
+                elif new.is_dir:
+                    child = DiffNode(new.name, True)
+                    changes.append(child)
+                    stack.append((old, os.path.join(old_dir, old.name), new, os.path.join(new_dir, new.name), child))
+                i += 1
+                j += 1
+        for change in changes:
+            if change.status:
+                counts[change.status] += 1
+        diff_node.children = changes
+
+    # Drop folders with no change below them, children before parents
+    order = []
+    stack = [diff_root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(child for child in node.children if child.is_dir and child.status is None)
+    for node in reversed(order):
+        node.children = [child for child in node.children if child.status or child.children]
+    return diff_root, counts
+
+def get_unique_name(path, base_name, extension=''):
+    # One directory listing instead of an exists() call per candidate: collect the numeric
+    # suffixes already taken and return the lowest free one
+    try:
+        names = {os.path.normcase(name) for name in os.listdir(path)}
+    except FileNotFoundError:
+        names = set()
+    unique_name = f"{base_name}{extension}"
+    if os.path.normcase(unique_name) not in names:
+        return unique_name
+
+    prefix = os.path.normcase(base_name + '_')
+    suffix = os.path.normcase(extension)
+    taken = set()
+    for name in names:
+        if name.startswith(prefix) and name.endswith(suffix):
+            counter = name[len(prefix):len(name) - len(suffix)]
+            if counter.isascii() and counter.isdigit():
+                taken.add(int(counter))
     counter = 1
-    unique_name = base_name
-    while os.path.exists(os.path.join(path, unique_name)):
-        unique_name = f"{base_name}_{counter}"
+    while counter in taken:
         counter += 1
-    return unique_name
+    return f"{base_name}_{counter}{extension}"
+
+def get_unique_folder_name(path, base_name):
+    return get_unique_name(path, base_name)
 
 def get_unique_filename(path, base_name, extension):
-    counter = 1
-    unique_name = f"{base_name}{extension}"
-    while os.path.exists(os.path.join(path, unique_name)):
-        unique_name = f"{base_name}_{counter}{extension}"
-        counter += 1
-    return unique_name
+    return get_unique_name(path, base_name, extension)
+
+def make_unique_folder(path, base_name, timestamped=False):
+    # os.mkdir fails if another run took the name in the meantime, in which case the next free
+    # name is picked. A timestamped name is tried directly, without listing the parent first
+    if timestamped:
+        base_name = f"{base_name}_{time.strftime('%Y%m%d-%H%M%S')}"
+        try:
+            os.mkdir(os.path.join(path, base_name))
+            return os.path.join(path, base_name)
+        except FileExistsError:
+            pass
+    while True:
+        folder = os.path.join(path, get_unique_folder_name(path, base_name))
+        try:
+            os.mkdir(folder)
+            return folder
+        except FileExistsError:
+            continue
+
+def open_unique_file(path, base_name, extension):
+    # Mode 'x' is O_CREAT | O_EXCL, so two runs never write to the same file
+    while True:
+        file_path = os.path.join(path, get_unique_filename(path, base_name, extension))
+        try:
+            return file_path, open(file_path, 'x', encoding='utf-8')
+        except FileExistsError:
+            continue
+
+class InotifyBackend:
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    FILE_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE  # Sizes and mtimes shown in metadata mode
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, file_events=False):
+        import ctypes
+        import ctypes.util
+
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = self.ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.mask = self.WATCH_MASK | (self.FILE_MASK if file_events else 0)
+        self.paths = {}
+        self.watches = {}
+
+    def close(self):
+        os.close(self.fd)
+
+    def add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            errno = self.ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.paths[wd] = path
+        self.watches[path] = wd
+
+    def remove(self, path):
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        # Returns the set of watched directories whose listing (or, with file events, a file) changed
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        dirty = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size + name_length
+            if mask & self.IN_Q_OVERFLOW:
+                dirty.update(self.watches)  # Events were dropped, re-list everything
+            elif mask & self.IN_IGNORED:
+                path = self.paths.pop(wd, None)
+                if path is not None and self.watches.get(path) == wd:
+                    del self.watches[path]
+            elif wd in self.paths:
+                dirty.add(self.paths[wd])
+        return dirty
+
+class PollingBackend:
+    def __init__(self, interval=1.0, file_events=False):
+        self.interval = interval
+        self.file_events = file_events
+        self.mtimes = {}
+
+    def close(self):
+        pass
+
+    def signature(self, path):
+        # A folder's mtime only changes when entries are added, removed or renamed; with
+        # file_events the sizes and mtimes of its files are folded in, at one scandir per poll
+        mtime_ns = os.stat(path).st_mtime_ns
+        if not self.file_events:
+            return mtime_ns
+        with os.scandir(path) as entries:
+            stats = [(entry.name, entry.stat(follow_symlinks=False)) for entry in entries]
+        return hash((mtime_ns, tuple(sorted((name, stat.st_size, stat.st_mtime_ns) for name, stat in stats))))
+
+    def add(self, path):
+        self.mtimes[path] = self.signature(path)
+
+    def remove(self, path):
+        self.mtimes.pop(path, None)
+
+    def read(self, timeout):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        dirty = set()
+        for path, mtime_ns in self.mtimes.items():
+            try:
+                current = self.signature(path)
+            except OSError:
+                continue  # Removed; the parent directory reports the change
+            if current != mtime_ns:
+                self.mtimes[path] = current
+                dirty.add(path)
+        return dirty
+
+class TreeWatcher:
+    # Keeps the tree alive after the first run and re-lists only the directories that
+    # changed, then rewrites every output file (format -> path) from memory
+    def __init__(self, dir_path, tree, scanner, output_paths, compress=None, debounce=0.5, max_delay=5.0,
+                 html_writer=write_html_tree, on_change=None):
+        self.dir_path = dir_path
+        self.tree = tree
+        self.scanner = scanner
+        self.output_paths = output_paths
+        self.compress = compress
+        self.html_writer = html_writer
+        self.on_change = on_change
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.dir_nodes = {}
+        # Metadata mode shows file sizes and mtimes, so rewriting a file also counts as a change
+        try:
+            self.backend = InotifyBackend(file_events=scanner.metadata)
+            self.register(tree, dir_path)
+        except (OSError, AttributeError):
+            # No inotify on this platform, or the watch limit is too low for this tree
+            self.backend = PollingBackend(file_events=scanner.metadata)
+            self.dir_nodes = {}
+            self.register(tree, dir_path)
+
+    def register(self, node, path):
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            self.dir_nodes[path] = node
+            self.backend.add(path)  # Watch before listing so nothing created in between is missed
+            for child in self.scanner.load_children(node, path):
+                if child.is_dir:
+                    stack.append((child, os.path.join(path, child.name)))
+
+    def unregister(self, node, path):
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            self.dir_nodes.pop(path, None)
+            self.backend.remove(path)
+            for child in node.children or ():
+                if child.is_dir:
+                    stack.append((child, os.path.join(path, child.name)))
+
+    def relist(self):
+        # With --max-total-entries, a change in one folder moves the cut-off for every folder
+        # after it, so the tree is listed again from a fresh budget, in render order
+        for path in self.dir_nodes:
+            self.backend.remove(path)
+        self.dir_nodes = {}
+        scanner = self.scanner
+        scanner.remaining = scanner.max_total_entries
+        if scanner.visited is not None:
+            scanner.visited.clear()
+            scanner.dir_keys.clear()
+        self.tree = scan_tree(self.dir_path, scanner=scanner)
+        self.register(self.tree, self.dir_path)
+
+    def patch(self, dirty):
+        if self.scanner.max_total_entries is not None:
+            self.relist()
+            return
+        # Parents first, so a directory removed by its parent's patch is skipped
+        for path in sorted(dirty, key=len):
+            node = self.dir_nodes.get(path)
+            if node is None:
+                continue
+            if not os.path.isdir(path):
+                continue  # Removed; the parent's patch drops it
+            children = self.scanner.scan(path)
+            children = self.scanner.claim(children, path)
+
+            previous = {child.name: child for child in node.children if child.is_dir}
+            for index, child in enumerate(children):
+                if not child.is_dir:
+                    continue
+                if child.name in previous:
+                    children[index] = previous.pop(child.name)  # Keep the already-listed subtree
+                else:
+                    self.register(child, os.path.join(path, child.name))
+            for name, child in previous.items():
+                self.unregister(child, os.path.join(path, name))
+            node.children = children
+
+    def render(self):
+        search_index = None
+        if 'html' in self.output_paths and 'index' in self.output_paths:
+            search_index = search_index_json(self.tree, self.dir_path, self.scanner)
+        for output_format, file_path in self.output_paths.items():
+            compression = self.compress if output_format in MACHINE_WRITERS else None
+            temp_path = file_path + '.tmp'
+            with open_output(temp_path, compression) as out_file:
+                write_output(output_format, self.dir_path, out_file, self.tree, self.scanner,
+                             html_writer=self.html_writer, search_index=search_index)
+            os.replace(temp_path, file_path)
+
+    def run(self):
+        backend_name = 'inotify' if isinstance(self.backend, InotifyBackend) else 'polling'
+        print(f"Watching {len(self.dir_nodes)} directories with {backend_name} (Ctrl+C to stop)")
+        try:
+            while True:
+                dirty = self.backend.read(None)
+                if not dirty:
+                    continue
+
+                # Debounce: keep collecting until the burst of events settles
+                first_event = time.perf_counter()
+                while time.perf_counter() - first_event < self.max_delay:
+                    more = self.backend.read(self.debounce)
+                    if not more:
+                        break
+                    dirty |= more
+
+                patch_start = time.perf_counter()
+                self.patch(dirty)
+                if self.on_change is not None:
+                    self.on_change(self.tree)
+                self.render()
+                done = time.perf_counter()
+                print(f"Updated {len(dirty)} directories in {(done - patch_start) * 1000:.0f} ms "
+                      f"({(done - first_event) * 1000:.0f} ms after the first event)")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.backend.close()
+
+EXIT_OK = 0
+EXIT_BAD_PATH = 1  # A path argument is not a directory
+EXIT_USAGE = 2  # What argparse exits with on bad arguments
+EXIT_WRITE_FAILED = 3
+# find follows grep: 1 when nothing matched, 2 when the index could not be read
+EXIT_NO_MATCH = 1
+EXIT_FIND_FAILED = 2
+
+OUTPUT_FORMATS = ['txt', 'html'] + sorted(MACHINE_WRITERS)
+
+def open_in_viewer(file_path):
+    # TXT files open in the default editor on Windows, everything else in the browser
+    if sys.platform == "win32" and file_path.endswith('.txt'):
+        os.startfile(file_path)
+    else:
+        import webbrowser
+        webbrowser.open('file://' + os.path.realpath(file_path))
+
+def make_html_writer(args, html_file_path=None):
+    if args.html_viewer == 'lazy':
+        data_path = None
+        if args.html_data_file and html_file_path is not None:
+            data_path = os.path.splitext(html_file_path)[0] + '.data.js'
+        return functools.partial(write_html_viewer, data_path=data_path)
+    return write_html_tree
+
+def write_output(output_format, dir_path, out_file, tree, scanner, keep_tree=True, html_writer=write_html_tree,
+                 search_index=None):
+    if output_format == 'txt':
+        write_tree_lines(iter_tree_lines(dir_path, tree=tree, keep_tree=keep_tree, scanner=scanner), out_file)
+    elif output_format == 'html':
+        html_writer(dir_path, out_file, tree=tree, scanner=scanner, search_index=search_index)
+    elif output_format == 'index' and search_index is not None:
+        out_file.write(search_index)
+    else:
+        MACHINE_WRITERS[output_format](iter_tree_entries(dir_path, tree=tree, keep_tree=keep_tree, scanner=scanner),
+                                       out_file)
+
+def cache_file_path(output_root, dir_path, kind):
+    # Roots with the same folder name (src, docs, ...) get their own cache files, keyed by a short
+    # hash of the absolute path, so a batch run or a shared --output-dir does not mix them up
+    import hashlib
+    root_hash = hashlib.blake2b(os.path.abspath(dir_path).encode('utf-8', 'surrogateescape'), digest_size=4).hexdigest()
+    return os.path.join(output_root, f"{os.path.basename(dir_path)}_output.{root_hash}.{kind}.json")
+
+def generate_outputs(dir_path, args, output_root, rules=None, executor=None, hash_pool=None, open_outputs=True):
+    # Writes every requested format for one root and returns the exit code and the files written.
+    # Batch runs pass in the exclusion rules and pools so every root shares them
+    formats = args.format or ['txt', 'html', 'index']
+    top_level_dir_name = os.path.basename(dir_path)
+
+    # Reuse unchanged directory listings from the previous run's snapshot. Stdout runs leave no files behind
+    profile = RunProfile(args.profile_top) if args.profile else None
+    phase = profile.phase if profile is not None else (lambda name: contextlib.nullcontext())
+    snapshot = snapshot_path = None
+    # Metadata runs need a stat per entry, and jsonl, json and csv a file size, which the snapshot
+    # does not keep, so they bypass it and leave the saved listings alone for the next plain run
+    file_sizes = any(output_format in ('jsonl', 'json', 'csv') for output_format in formats)
+    if not args.no_cache and not args.stdout and not args.metadata and not file_sizes:
+        with phase('snapshot load'):
+            snapshot_path = cache_file_path(output_root, dir_path, 'snapshot')
+            snapshot = TreeSnapshot.load(snapshot_path, dir_path)
+    scanner = DirectoryScanner(exclude_files=[], workers=args.workers, snapshot=snapshot,
+                               exclude_patterns=args.exclude, use_gitignore=args.gitignore,
+                               max_depth=args.max_depth, max_entries_per_dir=args.max_entries_per_dir,
+                               max_total_entries=args.max_total_entries, metadata=args.metadata,
+                               rules=rules, executor=executor, symlinks=args.symlinks, profile=profile,
+                               sort=args.sort, dirs_first=args.dirs_first, file_sizes=file_sizes)
+    tree = scanner.new_root(dir_path)
+
+    # Only computed when used: the path hash needs hashlib, which plain runs never import
+    hash_cache_path = cache_file_path(output_root, dir_path, 'hashes') if args.hash and not args.stdout else None
+    hash_cache = load_hash_cache(hash_cache_path) if hash_cache_path else {}
+
+    # Cache and report files that cannot be written do not stop the run, but still make it
+    # exit with EXIT_WRITE_FAILED
+    write_errors = []
+
+    def write_failed(what, e):
+        print(f"Could not write {what}: {e}", file=sys.stderr)
+        write_errors.append(what)
+
+    def summarize(tree):
+        # Metadata mode needs the whole tree before the first line: folder totals are rolled up
+        # bottom-up, and size ordering depends on them
+        compute_totals(tree)
+        if args.sort_by_size or args.top is not None:
+            sort_by_size(tree, args.top)
+        if args.hash:
+            seen = hash_tree(tree, dir_path, args.hash_workers, hash_cache, hash_pool)
+            hash_cache.clear()
+            hash_cache.update(seen)  # Forget files that are gone
+            if hash_cache_path is not None:
+                try:
+                    save_hash_cache(hash_cache_path, hash_cache)
+                except OSError as e:
+                    write_failed(hash_cache_path, e)
+
+    if args.stdout:
+        # A single format streamed to standard output; without metadata nothing is kept
+        sys.stdout.reconfigure(encoding='utf-8')
+        out_file = ProfiledWriter(sys.stdout, profile) if profile is not None else sys.stdout
+        try:
+            with scanner:
+                if args.metadata:
+                    with phase('scan'):
+                        scan_tree(dir_path, scanner=scanner, tree=tree)
+                    with phase('summarize'):
+                        summarize(tree)
+                with phase(f"render {formats[0]}"):
+                    write_output(formats[0], dir_path, out_file, tree, scanner, keep_tree=False,
+                                 html_writer=make_html_writer(args))
+                    if formats[0] == 'txt':
+                        out_file.write('\n')
+                    sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader went away (e.g. piped into head); stop quietly
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        if scanner.list_errors:
+            print(f"{scanner.list_errors} directories could not be listed and are marked in the output", file=sys.stderr)
+        if profile is not None:
+            print(RunProfile.summary(profile.report(scanner)), file=sys.stderr)
+        return EXIT_OK, {}
+
+    # Create output folder
+    try:
+        output_folder = make_unique_folder(output_root, f"{top_level_dir_name}_output", args.timestamped)
+    except OSError as e:
+        print(f"Could not create the output folder for {dir_path}: {e}", file=sys.stderr)
+        return EXIT_WRITE_FAILED, {}
+
+    output_paths = {}
+    for output_format in formats:
+        extension = FORMAT_EXTENSIONS.get(output_format, f".{output_format}")
+        if output_format in MACHINE_WRITERS:
+            extension += COMPRESSION_SUFFIXES.get(args.compress, '')
+        output_paths[output_format] = os.path.join(
+            output_folder, get_unique_filename(output_folder, 'directory_structure', extension))
+    html_writer = make_html_writer(args, output_paths.get('html'))
+
+    # The first output lists each directory once; the tree is only kept if another output or
+    # the watcher needs it afterwards. The HTML page embeds the same search index as the index
+    # file, so when both are written it is built once, by whichever comes first
+    share_index = 'html' in formats and 'index' in formats
+    search_index = None
+    walk_start = time.perf_counter()
+    try:
+        with scanner:
+            if args.metadata:
+                with phase('scan'):
+                    scan_tree(dir_path, scanner=scanner, tree=tree)
+                with phase('summarize'):
+                    summarize(tree)
+            for index, output_format in enumerate(formats):
+                keep_tree = args.watch or index < len(formats) - 1
+                compression = args.compress if output_format in MACHINE_WRITERS else None
+                if share_index and search_index is None and output_format in ('html', 'index'):
+                    with phase('search index'):
+                        search_index = search_index_json(tree, dir_path, scanner)
+                with phase(f"render {output_format}"), open_output(output_paths[output_format], compression) as out_file:
+                    if profile is not None:
+                        out_file = ProfiledWriter(out_file, profile)
+                    write_output(output_format, dir_path, out_file, tree, scanner, keep_tree, html_writer,
+                                 search_index)
+    except OSError as e:
+        print(f"Could not write the output for {dir_path}: {e}", file=sys.stderr)
+        return EXIT_WRITE_FAILED, {}
+    walk_time = time.perf_counter() - walk_start
+    if scanner.list_errors:
+        print(f"{scanner.list_errors} directories could not be listed and are marked in the output", file=sys.stderr)
+
+    if snapshot is not None:
+        with phase('snapshot save'):
+            try:
+                snapshot.save(snapshot_path)
+            except OSError as e:
+                write_failed(snapshot_path, e)
+        if snapshot.reused:
+            print(f"Reused {snapshot.reused} of {scanner.dirs_listed} directory listings from the snapshot")
+
+    if args.workers > 1:
+        speedup = scanner.list_time / walk_time if walk_time else 1.0
+        print(f"Listed {scanner.dirs_listed} directories in {walk_time:.2f}s with {args.workers} workers "
+              f"({scanner.list_time:.2f}s of serial listing time, estimated {speedup:.1f}x speedup)")
+
+    if profile is not None:
+        report = profile.report(scanner)
+        report_path = os.path.join(output_folder, 'profile.json')
+        try:
+            with open(report_path, 'w', encoding='utf-8') as report_file:
+                json.dump(report, report_file, indent=2)
+        except OSError as e:
+            write_failed(report_path, e)
+        print(RunProfile.summary(report))
+
+    for output_path in output_paths.values():
+        print(f"Wrote {output_path}")
+        if open_outputs and not args.no_open and not output_path.endswith(tuple(COMPRESSION_SUFFIXES.values())):
+            open_in_viewer(output_path)
+
+    if args.watch:
+        scanner.snapshot = None  # Re-list changed directories for real instead of trusting mtimes
+        TreeWatcher(dir_path, tree, scanner, output_paths, args.compress, debounce=args.debounce,
+                    html_writer=html_writer, on_change=summarize if args.metadata else None).run()
+    return (EXIT_WRITE_FAILED if write_errors else EXIT_OK), output_paths
+
+def find_index_file(path):
+    # An output folder holds the index of its run; a later write (e.g. _1) wins
+    if os.path.isfile(path):
+        return path
+    candidates = [entry.path for entry in os.scandir(path)
+                  if entry.name.startswith('directory_structure') and '.index.json' in entry.name]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+def find_main(argv):
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} find",
+                                     description="Search the index written by an earlier run, without "
+                                                 "touching the directory itself.")
+    parser.add_argument('index', help="a .index.json file, or the output folder holding one")
+    parser.add_argument('query', help="part of a name, or a glob such as '*.py' (case-insensitive)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--exact', action='store_const', const='exact', dest='mode', help="match whole names only")
+    mode.add_argument('--glob', action='store_const', const='glob', dest='mode',
+                      help="treat the query as a glob even without wildcards")
+    mode.add_argument('--substring', action='store_const', const='substring', dest='mode',
+                      help="treat wildcards in the query as plain characters")
+    parser.add_argument('--type', choices=['file', 'dir'], help="only list files or only folders")
+    parser.add_argument('--limit', type=int, metavar='N', help="print at most N matches")
+    parser.add_argument('--relative', action='store_true', help="print paths relative to the indexed root")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.index):
+        parser.error(f"{args.index} does not exist")
+    try:
+        index_path = find_index_file(args.index)
+    except OSError as e:
+        print(f"Could not read {args.index}: {e}", file=sys.stderr)
+        return EXIT_FIND_FAILED
+    if index_path is None:
+        parser.error(f"no search index found in {args.index}")
+    try:
+        index = SearchIndex.load(index_path)
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        print(f"Could not read {index_path}: {e}", file=sys.stderr)
+        return EXIT_FIND_FAILED
+
+    mode = args.mode or ('glob' if any(char in args.query for char in '*?[') else 'substring')
+    entry_ids = index.find(args.query, mode, args.type)
+    sys.stdout.reconfigure(encoding='utf-8')
+    for entry_id in entry_ids[:args.limit]:
+        path = index.path(entry_id)
+        print(path if args.relative else os.path.join(index.root, path))
+    return EXIT_OK if entry_ids else EXIT_NO_MATCH
+
+def read_roots_file(roots_path):
+    # One directory per line; blank lines and lines starting with # are skipped
+    with open(roots_path, 'r', encoding='utf-8') as roots_file:
+        return [line.strip() for line in roots_file if line.strip() and not line.lstrip().startswith('#')]
+
+def write_batch_index(results, index_dir, out_file):
+    import html
+
+    # One row per root with links to its outputs, relative so the folder can be moved as a whole
+    ok_count = sum(1 for _, exit_code, _, _ in results if exit_code == EXIT_OK)
+    out_file.write(f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Directory Trees</title>
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+        }}
+        td, th {{
+            padding: 4px 12px;
+            text-align: left;
+        }}
+        .failed {{
+            color: #b00;
+        }}
+    </style>
+</head>
+<body>
+    <h1>Directory Trees</h1>
+    <p>{ok_count} of {len(results)} roots written</p>
+    <table>
+        <tr><th>Root</th><th>Outputs</th><th>Time</th></tr>
+""")
+    for dir_path, exit_code, output_paths, seconds in results:
+        # A root whose outputs were written but whose cache could not be saved keeps its links
+        if output_paths:
+            links = ' '.join(
+                f'<a href="{html.escape(os.path.relpath(path, index_dir).replace(os.sep, "/"))}">{output_format}</a>'
+                for output_format, path in output_paths.items())
+        else:
+            links = 'invalid directory' if exit_code == EXIT_BAD_PATH else 'could not be written'
+        row_class = '' if exit_code == EXIT_OK else ' class="failed"'
+        out_file.write(f'        <tr{row_class}><td>{html.escape(dir_path)}</td><td>{links}</td>'
+                       f'<td>{seconds:.2f}s</td></tr>\n')
+    out_file.write("""    </table>
+</body>
+</html>
+""")
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['find']:
+        # A directory literally named "find" can still be listed as ./find
+        return find_main(argv[1:])
+    parser = argparse.ArgumentParser(description="Generate TXT and HTML directory trees.")
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help="directories to list; without any, the path is asked for interactively")
+    parser.add_argument('--roots-file', metavar='FILE',
+                        help="also list every directory named in FILE, one per line, and write an index page")
+    parser.add_argument('--format', action='append', choices=OUTPUT_FORMATS, default=[],
+                        help="output format to write, repeatable (default: txt, html and the search index). "
+                             "jsonl, json and csv stream file sizes; folder sizes need --metadata")
+    parser.add_argument('-o', '--output-dir', metavar='DIR',
+                        help="create the <name>_output folders here (default: next to the script)")
+    parser.add_argument('--timestamped', action='store_true',
+                        help="name output folders <name>_output_<YYYYmmdd-HHMMSS> instead of numbering them")
+    parser.add_argument('--stdout', action='store_true',
+                        help="write a single format to standard output instead of files")
+    parser.add_argument('--no-open', action='store_true',
+                        help="do not open the written files afterwards")
+    parser.add_argument('--compress', choices=sorted(COMPRESSION_SUFFIXES),
+                        help="compress the jsonl, json and csv outputs while writing them")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of threads listing directories concurrently (default: 1)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="do not read or write the directory snapshot used for incremental runs")
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help="skip entries matching a name, glob or .gitignore-style path pattern (repeatable)")
+    parser.add_argument('--gitignore', action='store_true',
+                        help="also skip entries ignored by .gitignore files found during the walk")
+    parser.add_argument('--symlinks', choices=['skip', 'show', 'follow'], default='show',
+                        help="leave symlinks out, show them with their target without following them, or follow "
+                             "linked directories, listing each physical directory once and marking the other paths "
+                             "to it \"(listed at PATH)\" (default: show)")
+    parser.add_argument('--sort', choices=SORT_ORDERS, default='name',
+                        help="order entries by case-insensitive name, by name with numbers compared by value "
+                             "(file2 before file10), or leave them in filesystem order (default: name)")
+    parser.add_argument('--dirs-first', action='store_true',
+                        help="list folders before files in every output, not only in the HTML tree")
+    parser.add_argument('--max-depth', type=int, metavar='N',
+                        help="only list directories down to N levels below the root")
+    parser.add_argument('--max-entries-per-dir', type=int, metavar='N',
+                        help="show at most N entries per directory")
+    parser.add_argument('--max-total-entries', type=int, metavar='N',
+                        help="stop listing once N entries have been shown")
+    parser.add_argument('--metadata', action='store_true',
+                        help="show file sizes and mtimes, with per-folder totals")
+    parser.add_argument('--sort-by-size', action='store_true',
+                        help="with --metadata, list the largest entries first")
+    parser.add_argument('--top', type=int, metavar='N',
+                        help="with --metadata, keep only the N largest entries per folder (implies --sort-by-size)")
+    parser.add_argument('--hash', action='store_true',
+                        help="add a BLAKE2 fingerprint of each file (implies --metadata)")
+    parser.add_argument('--hash-workers', type=int, metavar='N',
+                        help="processes used for hashing (default: one per CPU)")
+    parser.add_argument('--html-viewer', choices=['list', 'lazy'], default='list',
+                        help="'list' writes the whole tree as nested HTML lists; 'lazy' embeds it as JSON and "
+                             "only renders the rows in view, for very large trees (default: list)")
+    parser.add_argument('--html-data-file', action='store_true',
+                        help="with --html-viewer lazy, write the tree data to a .data.js file next to the HTML")
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two directories or snapshot files and write a diff tree instead. Snapshots "
+                             "keep names only, so with a snapshot side only added and removed entries are found, "
+                             "not modified files")
+    parser.add_argument('--profile', action='store_true',
+                        help="time each phase, count syscalls and write profile.json next to the outputs")
+    parser.add_argument('--profile-top', type=int, default=10, metavar='N',
+                        help="with --profile, report the N directories that took longest to list (default: 10)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and rewrite every output file when the directory changes")
+    parser.add_argument('--debounce', type=float, default=0.5,
+                        help="seconds to wait for a burst of changes to settle in watch mode (default: 0.5)")
+    args = parser.parse_args(argv)
+    if args.hash:
+        args.metadata = True
+    if args.stdout:
+        if len(args.format) > 1:
+            parser.error("--stdout writes a single format")
+        if args.compress:
+            parser.error("--compress cannot be combined with --stdout")
+        if args.watch:
+            parser.error("--watch needs output files, not --stdout")
+        args.no_open = True
+    paths = list(args.paths)
+    if args.roots_file:
+        try:
+            paths += read_roots_file(args.roots_file)
+        except OSError as e:
+            parser.error(f"cannot read --roots-file: {e}")
+    if args.watch and len(paths) > 1:
+        parser.error("--watch follows a single directory")
+    if args.compress == 'zstd' and load_zstandard() is None:
+        parser.error("--compress zstd needs the 'zstandard' package (pip install zstandard)")
 
-if __name__ == "__main__":
-    # Ask the user for the folder path
-    dir_path = input("Enter the directory path: ").strip()
-    if not os.path.isdir(dir_path):
-        print("Invalid directory path.")
-        sys.exit(1)
-    
-    # Get the top-level directory name for output folder naming
-    top_level_dir_name = os.path.basename(os.path.abspath(dir_path))
-    
     # Determine the directory of the executable or script
     if getattr(sys, 'frozen', False):
         # Running as compiled executable
         script_dir = os.path.dirname(sys.executable)
     else:
-        # Running as script
-        script_dir = os.path.dirname(os.path.realpath(__file__))
-    
-    # Create output folder
-    output_folder_name = get_unique_folder_name(script_dir, f"{top_level_dir_name}_output")
-    output_folder = os.path.join(script_dir, output_folder_name)
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Generate unique file names
-    txt_file_name = get_unique_filename(output_folder, 'directory_structure', '.txt')
-    html_file_name = get_unique_filename(output_folder, 'directory_structure', '.html')
-
-    # Generate tree and write to TXT file
-    txt_file_path = os.path.join(output_folder, txt_file_name)
-    with open(txt_file_path, 'w', encoding='utf-8') as txt_file:
-        result_lines = generate_tree(dir_path, exclude_files=[], is_root=True)
-        txt_file.write('\n'.join(result_lines))
-
-    # Automatically open the TXT file
-    if sys.platform == "win32":
-        os.startfile(txt_file_path)
-    else:
-        webbrowser.open('file://' + os.path.realpath(txt_file_path))
-    
-    # Generate HTML file
-    html_file_path = os.path.join(output_folder, html_file_name)
-    with open(html_file_path, 'w', encoding='utf-8') as html_file:
-        html_content = generate_html_tree(dir_path, exclude_files=[])
-        html_file.write(html_content)
-
-    # Automatically open the HTML file in the default web browser
-    webbrowser.open('file://' + os.path.realpath(html_file_path))
+        # Running as script, or from a zipapp (the archive's folder, not the path inside it)
+        script_dir = os.path.dirname(os.path.realpath(getattr(__loader__, 'archive', None) or __file__))
+    output_root = os.path.abspath(args.output_dir) if args.output_dir else script_dir
+    if not args.stdout:
+        try:
+            os.makedirs(output_root, exist_ok=True)
+        except OSError as e:
+            print(f"Could not create the output folder {output_root}: {e}", file=sys.stderr)
+            return EXIT_WRITE_FAILED
+
+    if args.diff:
+        try:
+            old_side = open_diff_side(args.diff[0], args.exclude)
+            reference = old_side[0].snapshot if isinstance(old_side[0].snapshot, SnapshotReader) else None
+            new_side = open_diff_side(args.diff[1], args.exclude, reference=reference)
+        except ValueError as e:
+            print(f"Cannot compare: {e}", file=sys.stderr)
+            return EXIT_BAD_PATH
+        if args.hash:
+            for scanner, root, root_path in (old_side, new_side):
+                if scanner.metadata:
+                    scan_tree(root_path, scanner=scanner, tree=root)
+                    hash_tree(root, root_path, args.hash_workers)
+        diff_root, counts = diff_trees(old_side, new_side)
+        new_path = new_side[2]
+        summary = f"{counts['added']} added, {counts['removed']} removed, {counts['modified']} modified"
+        if counts['touched']:
+            summary += f", {counts['touched']} with only a different mtime"
+
+        if args.stdout:
+            sys.stdout.reconfigure(encoding='utf-8')
+            write_tree_lines(iter_tree_lines(new_path, tree=diff_root, keep_tree=True), sys.stdout)
+            sys.stdout.write('\n')
+            print(summary, file=sys.stderr)
+            return EXIT_OK
+
+        try:
+            diff_folder = make_unique_folder(output_root, f"{os.path.basename(new_path)}_diff", args.timestamped)
+            diff_txt_path = os.path.join(diff_folder, 'directory_diff.txt')
+            diff_html_path = os.path.join(diff_folder, 'directory_diff.html')
+            with open(diff_txt_path, 'w', encoding='utf-8', buffering=1024 * 1024) as txt_file:
+                write_tree_lines(iter_tree_lines(new_path, tree=diff_root, keep_tree=True), txt_file)
+            with open(diff_html_path, 'w', encoding='utf-8', buffering=1024 * 1024) as html_file:
+                write_html_tree(new_path, html_file, tree=diff_root)
+        except OSError as e:
+            print(f"Could not write the diff: {e}", file=sys.stderr)
+            return EXIT_WRITE_FAILED
+        print(summary)
+
+        if not args.no_open:
+            open_in_viewer(diff_txt_path)
+            open_in_viewer(diff_html_path)
+        return EXIT_OK
+
+    if not paths:
+        # Ask the user for the folder path
+        paths = [input("Enter the directory path: ").strip()]
+
+    # A batch compiles the exclusion rules once and shares one listing pool and one hashing
+    # pool between all roots, instead of paying for them per root
+    batch = len(paths) > 1
+    rules = executor = hash_pool = None
+    if batch:
+        rules = DirectoryScanner.build_rules((), args.exclude, args.gitignore)
+        if args.workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=args.workers)
+        if args.hash and args.hash_workers != 1:
+            from concurrent.futures import ProcessPoolExecutor
+            hash_pool = ProcessPoolExecutor(max_workers=args.hash_workers)
+
+    exit_code = EXIT_OK
+    results = []
+    try:
+        for dir_path in paths:
+            root_start = time.perf_counter()
+            if not os.path.isdir(dir_path):
+                print(f"Invalid directory path: {dir_path}", file=sys.stderr)
+                root_exit_code, output_paths = EXIT_BAD_PATH, {}
+            else:
+                dir_path = os.path.abspath(dir_path)
+                root_exit_code, output_paths = generate_outputs(dir_path, args, output_root, rules, executor,
+                                                                hash_pool, open_outputs=not batch)
+            results.append((dir_path, root_exit_code, output_paths, time.perf_counter() - root_start))
+            exit_code = max(exit_code, root_exit_code)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if hash_pool is not None:
+            hash_pool.shutdown()
+
+    if batch and not args.stdout:
+        try:
+            index_path, index_file = open_unique_file(output_root, 'directory_index', '.html')
+            with index_file:
+                write_batch_index(results, output_root, index_file)
+        except OSError as e:
+            print(f"Could not write the batch index: {e}", file=sys.stderr)
+            return max(exit_code, EXIT_WRITE_FAILED)
+        print(f"Wrote {index_path} ({len(results)} roots)")
+        if not args.no_open:
+            open_in_viewer(index_path)
+    return exit_code
+
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()  # The hashing pool re-launches the frozen executable
+    sys.exit(main())
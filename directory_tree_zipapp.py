@@ -0,0 +1,50 @@
+import argparse
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipapp
+
+# Packs directory_tree_generator.v5.py into a single-file zipapp that starts without unpacking
+# anything and without compiling the script on every run:
+#   python directory_tree_zipapp.py
+#   python dist/directory_tree_generator.v5.pyz PATH --stdout
+
+MODULE_NAME = 'directory_tree_generator'
+
+# Guarded, so the hashing pool's worker processes can re-import __main__ without starting a run
+MAIN_SOURCE = f"""import sys
+
+import {MODULE_NAME}
+
+if __name__ == "__main__":
+    sys.exit({MODULE_NAME}.main())
+"""
+
+def build_zipapp(script_path, target_path, interpreter):
+    with tempfile.TemporaryDirectory() as stage_dir:
+        module_path = os.path.join(stage_dir, f"{MODULE_NAME}.py")
+        shutil.copyfile(script_path, module_path)
+        # zipimport cannot write __pycache__, so the bytecode is shipped next to the source. An
+        # unchecked hash-based .pyc is used as-is; another Python version falls back to the .py
+        py_compile.compile(module_path, cfile=os.path.join(stage_dir, f"{MODULE_NAME}.pyc"), doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        with open(os.path.join(stage_dir, '__main__.py'), 'w', encoding='utf-8') as main_file:
+            main_file.write(MAIN_SOURCE)
+        zipapp.create_archive(stage_dir, target_path, interpreter=interpreter)
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Build a zipapp of the directory tree generator.")
+    parser.add_argument('--script', default=os.path.join(script_dir, 'directory_tree_generator.v5.py'),
+                        help="generator script to pack (default: directory_tree_generator.v5.py)")
+    parser.add_argument('--output', default=os.path.join(script_dir, 'dist', 'directory_tree_generator.v5.pyz'),
+                        metavar='FILE', help="where to write the archive (default: dist/directory_tree_generator.v5.pyz)")
+    parser.add_argument('--python', default='/usr/bin/env python3', metavar='INTERPRETER',
+                        help="interpreter for the #! line (default: /usr/bin/env python3)")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    build_zipapp(args.script, args.output, args.python)
+    print(f"Wrote {args.output} (built with Python {sys.version.split()[0]})")
@@ -0,0 +1,107 @@
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+# The generator's file name has dots in it, so it is loaded from its path instead of imported
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'directory_tree_generator.v5.py')
+spec = importlib.util.spec_from_file_location('directory_tree_generator', SCRIPT_PATH)
+generator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generator)
+
+DEPTH = 5000
+
+def build_chain(depth):
+    # A folder chain whose children are already loaded, so nothing touches the disk
+    root = generator.TreeNode('root', True)
+    node = root
+    for level in range(depth):
+        child = generator.TreeNode(f"d{level}", True)
+        node.children = [child]
+        node = child
+    node.children = [generator.TreeNode('leaf.txt', False)]
+    return root
+
+class DeepTreeTest(unittest.TestCase):
+    def test_txt_lines(self):
+        lines = list(generator.iter_tree_lines('root', tree=build_chain(DEPTH), keep_tree=True,
+                                               scanner=generator.DirectoryScanner()))
+        self.assertEqual(len(lines), DEPTH + 2)
+        self.assertEqual(lines[0], 'root')
+        self.assertEqual(lines[1], '    └── d0')
+        self.assertEqual(lines[DEPTH], '    ' * DEPTH + '└── d' + str(DEPTH - 1))
+        self.assertEqual(lines[-1], '    ' * (DEPTH + 1) + '└── leaf.txt')
+
+    def test_html_list(self):
+        out_file = io.StringIO()
+        generator.write_html_list(build_chain(DEPTH), 'root', out_file, None, generator.DirectoryScanner())
+        html_text = out_file.getvalue()
+        self.assertEqual(html_text.count('<li class="folder">'), DEPTH)
+        self.assertEqual(html_text.count('<ul class="nested">'), DEPTH + 1)
+        self.assertEqual(html_text.count('</ul>'), DEPTH + 1)
+        self.assertIn('<li class="file"><span>📄 leaf.txt</span></li>', html_text)
+        self.assertTrue(html_text.endswith('leaf.txt</span></li></ul>' + '</li></ul>' * DEPTH))
+
+def is_excluded(rules, rel_path, is_dir):
+    # Walks the rules down the path the way the scanner does, one component per directory
+    parts = rel_path.split('/')
+    for part in parts[:-1]:
+        if rules.excludes(part, True):
+            return True
+        rules = rules.child_rules(part)
+    return rules.excludes(parts[-1], is_dir)
+
+# (pattern, path relative to where the pattern was given, is_dir, excluded)
+EXCLUDE_CASES = [
+    ('a/**/b', 'a/b', True, True),
+    ('a/**/b', 'a/x/y/b', False, True),
+    ('a/**/b', 'b', True, False),
+    ('a/**/b', 'c/a/b', True, False),
+    ('a/**/**/b', 'a/x/b', True, True),
+    ('**/foo/bar', 'foo/bar', False, True),
+    ('**/foo/bar', 'x/y/foo/bar', False, True),
+    ('**/foo/bar', 'foo/x/bar', False, False),
+    ('**/foo', 'x/foo', True, True),
+    ('/build', 'build', True, True),
+    ('/build', 'x/build', True, False),
+    ('build', 'x/build', True, True),
+    ('build/', 'build', True, True),
+    ('build/', 'build', False, False),
+    ('build/', 'x/build', True, True),
+    ('a/**', 'a', True, True),
+    ('a/**', 'a/f', False, True),
+    ('a/**', 'a', False, False),
+    ('a/**', 'c/a', True, False),
+    ('*.log', 'x/y/t.log', False, True),
+    ('a/*.log', 'a/t.log', False, True),
+    ('a/*.log', 'a/x/t.log', False, False),
+    ('\\#notes', '#notes', False, True),
+    ('!keep', 'keep', False, False),
+]
+
+class ExclusionRulesTest(unittest.TestCase):
+    def test_patterns(self):
+        for pattern, rel_path, is_dir, expected in EXCLUDE_CASES:
+            with self.subTest(pattern=pattern, path=rel_path, is_dir=is_dir):
+                rules = generator.ExclusionRules.from_patterns([pattern])
+                self.assertEqual(is_excluded(rules, rel_path, is_dir), expected)
+
+    def test_gitignore_is_anchored_to_its_folder(self):
+        # A .gitignore in sub/ anchors "/build" and "out/log" to sub/, not to the root
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gitignore_path = os.path.join(temp_dir, '.gitignore')
+            with open(gitignore_path, 'w', encoding='utf-8') as gitignore_file:
+                gitignore_file.write("# comment\n/build\nout/log\n*.tmp\n")
+            root_rules = generator.ExclusionRules.from_patterns([])
+            sub_rules = root_rules.child_rules('sub').with_gitignore(gitignore_path)
+        self.assertTrue(is_excluded(sub_rules, 'build', True))
+        self.assertFalse(is_excluded(sub_rules, 'x/build', True))
+        self.assertTrue(is_excluded(sub_rules, 'out/log', False))
+        self.assertFalse(is_excluded(sub_rules, 'x/out/log', False))
+        self.assertTrue(is_excluded(sub_rules, 'x/a.tmp', False))
+        self.assertFalse(is_excluded(root_rules, 'sub/build', True))
+        self.assertFalse(is_excluded(root_rules, 'a.tmp', False))
+
+if __name__ == "__main__":
+    unittest.main()